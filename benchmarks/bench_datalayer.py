@@ -0,0 +1,258 @@
+"""benchmarks for the hot paths of the data layer
+
+Usage::
+
+    python benchmarks/bench_datalayer.py [options]
+
+By default the collections are kept in memory (see ``quantumblog.db.tests.memorydb``) so only
+the python side is measured. Use ``--mongo`` to run against a local
+``mongod`` instead; the ``quantumblog_bench`` database is dropped first.
+
+For every benchmark we report the throughput, the latency percentiles and
+how much the peak memory of the process grew while running it. Use
+``--save FILE`` to store the results as a baseline and ``--compare FILE``
+to report benchmarks whose throughput dropped by more than ``--tolerance``
+percent compared to it.
+"""
+
+import datetime
+import gc
+import json
+import optparse
+import random
+import resource
+import sys
+import time
+from cStringIO import StringIO
+
+import pymongo
+import starflyer
+
+from quantumblog.db import Record, Collection, View, Field, ImageField, Events
+from quantumblog.db.tests.memorydb import MemoryDatabase, MemoryStorage
+
+WORDS = "music remix contest vote guitar drums bass synth track album".split()
+
+class SmallRecord(Record):
+    fields = {
+        'title' : Field(),
+        'user_id' : Field(),
+        'category_id' : Field(),
+        'contest_id' : Field(),
+        'date' : Field(),
+        'workflow' : Field(),
+    }
+
+class WideRecord(Record):
+    fields = dict([("field%02d" %i, Field()) for i in range(30)])
+
+class ImageRecord(Record):
+    fields = {
+        'title' : Field(),
+        'image' : ImageField(storage_name = "images"),
+    }
+
+class Smalls(Collection):
+    data_cls = SmallRecord
+
+class Wides(Collection):
+    data_cls = WideRecord
+
+class Images(Collection):
+    data_cls = ImageRecord
+
+class Users(Collection):
+    data_cls = SmallRecord
+
+def text(n=5):
+    return u" ".join([random.choice(WORDS) for i in range(n)])
+
+def small_data(users, categories, contests):
+    return {
+        'title' : text(),
+        'user_id' : random.choice(users),
+        'category_id' : random.choice(categories),
+        'contest_id' : random.choice(contests),
+        'date' : datetime.datetime.now(),
+        'workflow' : u"active",
+    }
+
+def wide_data():
+    return dict([("field%02d" %i, text(3)) for i in range(30)])
+
+def png(width, height):
+    import PIL.Image
+    img = PIL.Image.new("RGB", (width, height))
+    img.putdata([(i % 256, (i / 7) % 256, 128) for i in xrange(width*height)])
+    fp = StringIO()
+    img.save(fp, "PNG")
+    return fp.getvalue()
+
+def max_rss():
+    """return the peak memory of this process in KB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values) * p / 100.0))]
+
+def measure(name, func, n):
+    """call ``func(i)`` ``n`` times and return the results"""
+    gc.collect()
+    rss = max_rss()
+    timings = []
+    start = time.time()
+    for i in xrange(n):
+        t = time.time()
+        func(i)
+        timings.append((time.time() - t) * 1000)
+    total = time.time() - start
+    timings.sort()
+    return {
+        'name' : name,
+        'calls' : n,
+        'ops' : n / total,
+        'p50' : percentile(timings, 50),
+        'p90' : percentile(timings, 90),
+        'p99' : percentile(timings, 99),
+        'rss_growth' : max_rss() - rss,
+    }
+
+def setup(options):
+    """return the settings with all collections filled with test data"""
+    if options.mongo:
+        conn = pymongo.Connection()
+        conn.drop_database("quantumblog_bench")
+        db = conn.quantumblog_bench
+    else:
+        db = MemoryDatabase()
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    settings.storages = {'images' : MemoryStorage()}
+    settings.users = Users(db.users, settings = settings)
+    settings.categories = Users(db.categories, settings = settings)
+    settings.contests = Users(db.contests, settings = settings)
+    settings.smalls = Smalls(db.smalls, settings = settings)
+    settings.wides = Wides(db.wides, settings = settings)
+    settings.images = Images(db.images, settings = settings)
+
+    ids = {}
+    for name, n in (('users', 100), ('categories', 20), ('contests', 10)):
+        coll = settings[name]
+        ids[name] = [coll.put(SmallRecord(small_data([0], [0], [0])))['_id']
+                     for i in range(n)]
+    for i in range(options.docs):
+        settings.smalls.put(SmallRecord(small_data(ids['users'],
+            ids['categories'], ids['contests'])))
+        settings.wides.put(WideRecord(wide_data()))
+    return settings
+
+def benchmarks(settings, options):
+    """return a list of ``(name, func, n)`` tuples"""
+    n = options.calls
+    small = SmallRecord(small_data([1], [2], [3]), settings = settings)
+    small.set_collection(settings.smalls)
+    wide = WideRecord(wide_data(), settings = settings)
+    wide.set_collection(settings.wides)
+    small_doc = small.to_mongo()
+    wide_doc = wide.to_mongo()
+    small_ids = [o['_id'] for o in settings.smalls.all]
+
+    one = View('entry', user = ('user_id', settings.users, '_id'))
+    several = View('entry',
+        user = ('user_id', settings.users, '_id'),
+        category = ('category_id', settings.categories, '_id'),
+        contest = ('contest_id', settings.contests, '_id'))
+
+    b = [
+        ("Record.to_mongo small", lambda i: small.to_mongo(), n),
+        ("Record.to_mongo wide", lambda i: wide.to_mongo(), n),
+        ("Record.from_mongo small",
+            lambda i: SmallRecord.from_mongo(small_doc, settings.smalls), n),
+        ("Record.from_mongo wide",
+            lambda i: WideRecord.from_mongo(wide_doc, settings.wides), n),
+        ("Collection.get",
+            lambda i: settings.smalls.get(small_ids[i % len(small_ids)]), n),
+        ("Collection.put",
+            lambda i: settings.smalls.put(SmallRecord(small_data([1], [2], [3]))), n),
+        ("Collection.all", lambda i: settings.wides.all, max(n / 100, 5)),
+        ("View one mapping",
+            lambda i: one(settings.smalls.query.limit(20)), max(n / 10, 5)),
+        ("View three mappings",
+            lambda i: several(settings.smalls.query.limit(20)), max(n / 10, 5)),
+    ]
+
+    try:
+        import PIL.Image
+    except ImportError:
+        print "PIL is not installed, skipping ImageField benchmarks"
+        return b
+
+    field = ImageRecord.fields['image']
+    record = ImageRecord({}, settings = settings)
+    record.set_collection(settings.images)
+    for width, height in ((200, 150), (1024, 768), (3000, 2000)):
+        data = png(width, height)
+        def func(i, data=data):
+            field.to_mongo("image", {'fp' : StringIO(data)}, record)
+        b.append(("ImageField.to_mongo %sx%s" %(width, height), func,
+                  max(n / 1000, 3)))
+    return b
+
+def compare(results, baseline, tolerance):
+    """print the benchmarks which got slower and return their number"""
+    old = dict([(r['name'], r) for r in baseline])
+    regressions = 0
+    for r in results:
+        if not old.has_key(r['name']):
+            continue
+        change = (r['ops'] - old[r['name']]['ops']) / old[r['name']]['ops'] * 100
+        if change < -tolerance:
+            regressions = regressions + 1
+            print "REGRESSION %-30s %+.1f%%" %(r['name'], change)
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--mongo", dest="mongo", action="store_true",
+        help="use a local mongod instead of the in-memory collections")
+    parser.add_option("-d", "--docs", dest="docs", type="int", default=1000,
+        help="number of documents per collection [default: %default]")
+    parser.add_option("-n", "--calls", dest="calls", type="int", default=5000,
+        help="number of calls for the fast benchmarks [default: %default]")
+    parser.add_option("-k", "--filter", dest="filter", default=None,
+        help="only run benchmarks containing FILTER in their name")
+    parser.add_option("--save", dest="save", default=None,
+        help="store the results as baseline in SAVE")
+    parser.add_option("--compare", dest="compare", default=None,
+        help="compare the results to the baseline in COMPARE")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=20,
+        help="allowed slowdown in percent [default: %default]")
+    options, args = parser.parse_args()
+
+    random.seed(42)
+    settings = setup(options)
+    results = []
+    print "%-30s %10s %9s %9s %9s %9s" %("benchmark", "ops/s", "p50 ms",
+                                         "p90 ms", "p99 ms", "rss +KB")
+    for name, func, n in benchmarks(settings, options):
+        if options.filter and options.filter not in name:
+            continue
+        r = measure(name, func, n)
+        results.append(r)
+        print "%-30s %10.1f %9.3f %9.3f %9.3f %9d" %(name, r['ops'],
+            r['p50'], r['p90'], r['p99'], r['rss_growth'])
+
+    if options.save:
+        f = open(options.save, "w")
+        json.dump(results, f, indent=2)
+        f.close()
+
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.load(f)
+        f.close()
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
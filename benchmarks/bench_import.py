@@ -0,0 +1,93 @@
+"""benchmark the import time of ``quantumblog.db`` as a worker sees it
+
+Usage::
+
+    python benchmarks/bench_import.py [options]
+
+Every run starts a fresh python process. We measure importing the package,
+the first access of ``Record`` and ``Collection`` (which imports ``core``)
+and whether heavy libraries like PIL got imported on the way. Use
+``--save`` to store the results as a baseline and ``--baseline`` in CI to
+fail if the import got slower by more than ``--tolerance`` percent.
+"""
+
+import json
+import optparse
+import subprocess
+import sys
+import time
+
+HEAVY = ['PIL', 'boto', 'mutagen']
+
+def worker():
+    """import the package in this process and print the timings as JSON"""
+    start = time.time()
+    import quantumblog.db
+    package = time.time() - start
+    quantumblog.db.Record, quantumblog.db.Collection
+    core = time.time() - start
+    print json.dumps({
+        'package' : package * 1000,
+        'core' : core * 1000,
+        'modules' : len(sys.modules),
+        'heavy' : [m for m in HEAVY if m in sys.modules],
+    })
+
+def run_worker():
+    args = [sys.executable, __file__, "--worker"]
+    out = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
+    return json.loads(out)
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)/2]
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--runs", dest="runs", type="int", default=10,
+        help="number of processes to start [default: %default]")
+    parser.add_option("--save", dest="save", default=None,
+        help="store the results as baseline in SAVE")
+    parser.add_option("--baseline", dest="baseline", default=None,
+        help="compare the results to the baseline in BASELINE")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=20,
+        help="allowed slowdown in percent [default: %default]")
+    parser.add_option("--worker", dest="worker", action="store_true",
+        help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.worker:
+        worker()
+        return
+
+    runs = [run_worker() for i in range(options.runs)]
+    results = {
+        'package' : median([r['package'] for r in runs]),
+        'core' : median([r['core'] for r in runs]),
+        'modules' : runs[0]['modules'],
+        'heavy' : runs[0]['heavy'],
+    }
+    print "import quantumblog.db:     %7.1fms" %results['package']
+    print "first access of Record:    %7.1fms" %results['core']
+    print "modules loaded:            %7d" %results['modules']
+    print "heavy libraries loaded:    %s" %(", ".join(results['heavy']) or "none")
+
+    if options.save:
+        f = open(options.save, "w")
+        json.dump(results, f, indent=2)
+        f.close()
+
+    if options.baseline:
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+        limit = baseline['core'] * (1 + options.tolerance / 100.0)
+        if results['core'] > limit:
+            print "FAILED: %.1fms is slower than the baseline of %.1fms" %(
+                results['core'], baseline['core'])
+            sys.exit(1)
+        if results['heavy']:
+            print "FAILED: heavy libraries imported"
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""benchmark building the search index and querying it
+
+Usage::
+
+    python benchmarks/bench_search.py [options]
+
+This needs a running ``mongod`` on localhost. The records are stored in the
+``quantumblog_bench`` database which is dropped at the beginning.
+"""
+
+import optparse
+import random
+import time
+
+import pymongo
+import starflyer
+
+from quantumblog.db import Record, Collection, Field, Events
+
+WORDS = """music remix contest vote guitar drums bass synth vocals track
+mixing master studio record release album single artist band live concert
+festival winner entry comment sponsor banner genre electronic rock jazz
+ambient techno house dubstep folk sample loop beat tempo melody harmony
+chorus verse bridge lyrics producer engineer label download stream""".split()
+
+class BenchEntry(Record):
+    fields = {
+        'title' : Field(),
+        'content' : Field(),
+        'workflow' : Field(),
+    }
+    searchable = {
+        'title' : 3,
+        'content' : 1,
+    }
+
+class BenchEntries(Collection):
+    data_cls = BenchEntry
+
+def text(n):
+    return u" ".join([random.choice(WORDS) for i in range(n)])
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values) * p / 100.0))]
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--entries", dest="entries", type="int", 
+        default=100000, help="number of entries [default: %default]")
+    parser.add_option("-q", "--queries", dest="queries", type="int", 
+        default=200, help="number of queries [default: %default]")
+    options, args = parser.parse_args()
+
+    random.seed(42)
+    conn = pymongo.Connection()
+    conn.drop_database("quantumblog_bench")
+    db = conn.quantumblog_bench
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    entries = BenchEntries(db.entries, settings = settings)
+
+    batch = []
+    for i in xrange(options.entries):
+        batch.append({'title' : text(5), 'content' : text(80), 
+                      'workflow' : u"active"})
+        if len(batch) == 1000:
+            db.entries.insert(batch)
+            batch = []
+    if batch:
+        db.entries.insert(batch)
+
+    entries.ensure_indexes()
+    start = time.time()
+    n = entries.search_index.rebuild()
+    duration = time.time() - start
+    print "index build: %s entries in %.2fs (%.0f entries/s)" %(n, duration, n/duration)
+
+    timings = []
+    for i in range(options.queries):
+        q = text(random.randint(1,3))
+        start = time.time()
+        entries.search(q)
+        timings.append((time.time() - start) * 1000)
+    print "query latency: p50 %.1fms p90 %.1fms p99 %.1fms" %(
+        percentile(timings, 50), percentile(timings, 90), percentile(timings, 99))
+
+if __name__ == "__main__":
+    main()
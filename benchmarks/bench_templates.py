@@ -0,0 +1,90 @@
+"""benchmark the template loading time of a fresh worker with and without
+a precompiled bytecode cache
+
+Usage::
+
+    python benchmarks/bench_templates.py [options]
+
+Every run starts a new python process which creates the template 
+environment like ``quantumblog.setup.setup()`` does and loads all templates, 
+which is what the first requests of a worker have to do.
+"""
+
+import optparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+def worker(path):
+    """load all templates in a fresh process and print the time it took
+    and the number of templates which failed to load"""
+    import starflyer
+    from quantumblog.setup import create_environment
+    settings = starflyer.AttributeMapper()
+    settings.template_bytecode_cache = path is not None
+    settings.template_cache_path = path
+    settings.fragment_cache = None
+    start = time.time()
+    env = create_environment(settings)
+    failed = 0
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+        except Exception, e:
+            failed = failed + 1
+            print >>sys.stderr, "%s: %s" %(name, e)
+    print time.time() - start, failed
+
+def run_worker(path):
+    """return the time in ms and the number of failed templates"""
+    args = [sys.executable, __file__, "--worker"]
+    if path is not None:
+        args.extend(["--path", path])
+    out = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
+    elapsed, failed = out.split()
+    return float(elapsed) * 1000, int(failed)
+
+def report(name, results):
+    """print the timings of a scenario and return the number of failures"""
+    timings = sorted([r[0] for r in results])
+    failed = max([r[1] for r in results])
+    print "%-24s min %7.1fms median %7.1fms max %7.1fms failed %s" %(name, 
+        timings[0], timings[len(timings)/2], timings[-1], failed)
+    return failed
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--runs", dest="runs", type="int", default=5,
+        help="number of workers to start per scenario [default: %default]")
+    parser.add_option("--worker", dest="worker", action="store_true",
+        help=optparse.SUPPRESS_HELP)
+    parser.add_option("--path", dest="path", default=None,
+        help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.worker:
+        worker(options.path)
+        return
+
+    failed = report("no bytecode cache", 
+                    [run_worker(None) for i in range(options.runs)])
+
+    cold = []
+    for i in range(options.runs):
+        path = tempfile.mkdtemp()
+        cold.append(run_worker(path))
+        shutil.rmtree(path)
+    failed = failed + report("empty bytecode cache", cold)
+
+    path = tempfile.mkdtemp()
+    run_worker(path) # precompile
+    failed = failed + report("precompiled", 
+                             [run_worker(path) for i in range(options.runs)])
+    shutil.rmtree(path)
+    if failed:
+        print "templates failed to load, the timings are not meaningful"
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
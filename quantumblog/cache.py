@@ -0,0 +1,232 @@
+import collections
+import hashlib
+import threading
+
+from jinja2 import nodes, Markup
+from jinja2.ext import Extension
+
+from quantumblog.db import Collection, get_collections
+
+__all__ = ['LRUCache', 'FragmentCache', 'FragmentCacheExtension',
+           'record_stamps']
+
+def record_stamps(objs):
+    """return a list of ``(_id, _updated)`` tuples for all records found in
+    ``objs``. This can be a record, a list of them or the results of a
+    ``View`` which will be searched recursively."""
+    stamps = []
+    if isinstance(objs, dict):
+        if objs.has_key("_id"):
+            stamps.append((objs['_id'], objs.get("_updated", None)))
+        else:
+            for v in objs.values():
+                stamps.extend(record_stamps(v))
+    elif isinstance(objs, (list, tuple)):
+        for v in objs:
+            stamps.extend(record_stamps(v))
+    return stamps
+
+class LRUCache(object):
+    """a thread safe in-process cache keeping the ``size`` most recently
+    used values"""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.data = collections.OrderedDict() # least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """return the value for ``key`` or ``default``"""
+        self.lock.acquire()
+        try:
+            if not self.data.has_key(key):
+                return default
+            value = self.data.pop(key) # move it to the end
+            self.data[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, timeout=0):
+        """store ``value`` under ``key``. ``timeout`` is ignored and only
+        there for compatibility with shared backends."""
+        self.lock.acquire()
+        try:
+            if self.data.has_key(key):
+                del self.data[key]
+            self.data[key] = value
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        """remove ``key`` from the cache"""
+        self.lock.acquire()
+        try:
+            if self.data.has_key(key):
+                del self.data[key]
+        finally:
+            self.lock.release()
+
+class FragmentCache(object):
+    """a cache for rendered HTML fragments.
+
+    The key of a fragment is derived from its name and the ``_id`` and
+    ``_updated`` stamps of the records it depends on, so changing one of
+    the records automatically leads to a new key. Fragments can also depend
+    on whole collections (e.g. a list of the latest entries). For these we
+    keep a generation counter per collection which is incremented by the
+    ``put:after``, ``remove:after`` and ``update:after`` events (see 
+    ``connect()``).
+
+    Values are kept in an in-process ``LRUCache`` and optionally in a shared
+    ``backend`` which needs to provide ``get(key)``, ``set(key, value,
+    timeout)``, ``add(key, value, timeout)``, ``incr(key)`` and 
+    ``delete(key)`` like a memcache client does. If a backend is given the
+    generations are stored there as well so all processes see the 
+    invalidations.
+
+    Usage from Python::
+
+        html = cache.cached("sidebar", [entries, settings.entries],
+                            lambda: render_sidebar(entries))
+
+    and in templates using the ``FragmentCacheExtension``::
+
+        {% cache "sidebar", entries, settings.entries %}...{% endcache %}
+    """
+
+    def __init__(self, backend=None, size=1000, timeout=3600, prefix="qb",
+                 version=""):
+        """initialize the fragment cache
+
+        :param backend: an optional shared cache backend
+        :param size: the number of fragments to keep in process
+        :param timeout: the timeout in seconds for values in the backend
+        :param prefix: a prefix for all keys in the backend
+        :param version: included in all keys, e.g. the version of the static
+            files so fragments containing asset URLs are rendered again
+            after a new build
+        """
+        self.local = LRUCache(size)
+        self.backend = backend
+        self.timeout = timeout
+        self.prefix = prefix
+        self.version = version
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def _gen_key(self, name):
+        return "%s:gen:%s" %(self.prefix, name)
+
+    def generation(self, name):
+        """return the generation of the collection ``name``"""
+        if self.backend is not None:
+            return self.backend.get(self._gen_key(name)) or 0
+        return self.generations.get(name, 0)
+
+    def invalidate(self, name):
+        """invalidate all fragments depending on the collection ``name``.
+        With a backend we use its atomic ``incr`` so concurrent
+        invalidations from several processes are not lost."""
+        if self.backend is not None:
+            key = self._gen_key(name)
+            if self.backend.incr(key) is None:
+                # the counter doesn't exist yet. If another process creates
+                # it in the meantime ``add`` fails and we increment that one
+                if not self.backend.add(key, 1, 0):
+                    self.backend.incr(key)
+            return
+        self.lock.acquire()
+        try:
+            self.generations[name] = self.generations.get(name, 0) + 1
+        finally:
+            self.lock.release()
+
+    def key(self, name, deps=[]):
+        """return the cache key for the fragment ``name`` depending on
+        ``deps``, which can contain records, lists of records, ``View``
+        results and ``Collection`` instances"""
+        parts = [unicode(name), unicode(self.version)]
+        for dep in deps:
+            if isinstance(dep, Collection):
+                n = dep.collection.name
+                parts.append(u"%s#%s" %(n, self.generation(n)))
+            else:
+                for _id, updated in record_stamps(dep):
+                    parts.append(u"%s@%s" %(_id, updated))
+        digest = hashlib.sha1(u"|".join(parts).encode("utf-8")).hexdigest()
+        return "%s:frag:%s" %(self.prefix, digest)
+
+    def get(self, key):
+        """return the fragment stored under ``key`` or ``None``"""
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """store a fragment"""
+        self.local.set(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.timeout)
+
+    def cached(self, name, deps, render):
+        """return the cached fragment ``name`` or call ``render()`` to
+        create and store it"""
+        key = self.key(name, deps)
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    def __call__(self, name, e, settings):
+        """listener for the ``put:after``, ``remove:after`` and 
+        ``update:after`` events"""
+        self.invalidate(e['coll'].collection.name)
+
+    def connect(self, settings):
+        """connect the cache to the events of all collections in ``settings``"""
+        for coll in get_collections(settings).values():
+            for action in ("put:after", "remove:after", "update:after"):
+                settings.events.connect(coll.event_name(action), self)
+
+class FragmentCacheExtension(Extension):
+    """a Jinja2 extension adding the ``cache`` tag::
+
+        {% cache "entry_teaser", entry %}
+            ...
+        {% endcache %}
+
+    The first argument is the name of the fragment, the remaining ones are
+    passed to ``FragmentCache.key()``. The ``FragmentCache`` to use is
+    taken from the ``fragment_cache`` attribute of the environment. If it's
+    ``None`` the body is always rendered.
+    """
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+        name = parser.parse_expression()
+        deps = []
+        while parser.stream.skip_if('comma'):
+            deps.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_cache', [name, nodes.List(deps)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache(self, name, deps, caller):
+        """return the cached fragment or render it"""
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        return Markup(cache.cached(name, deps, caller))
@@ -0,0 +1,63 @@
+import datetime
+import hashlib
+import time
+
+from werkzeug import Response
+
+from quantumblog.cache import record_stamps
+
+__all__ = ['compute_validators', 'is_not_modified', 'set_validators']
+
+def to_utc(dt):
+    """convert a naive local datetime as stored by ``Record.to_mongo`` to
+    naive UTC without microseconds as used in HTTP dates"""
+    ts = time.mktime(dt.timetuple())
+    return datetime.datetime.utcfromtimestamp(ts)
+
+def compute_validators(objs, extra=u""):
+    """compute the ETag and Last-Modified date for a page showing ``objs``.
+
+    :param objs: the records the page depends on. This can be a record, a
+        list of records, ``View`` results or the result of 
+        ``Collection.stamps()``.
+    :param extra: additional data the page depends on, e.g. the id of the
+        logged in user or a version of the templates
+    :return: a tuple ``(etag, last_modified)``. 
+
+    Only pages showing a single record without any ``extra`` data get a
+    ``last_modified`` date, it's ``None`` otherwise. For lists the newest
+    ``_updated`` stamp doesn't change if a record drops out of the list or
+    an older one enters it and the date doesn't know about ``extra``, so
+    an ``If-Modified-Since`` request could wrongly get a 304. The ETag
+    covers all of this.
+    """
+    stamps = record_stamps(objs)
+    parts = [unicode(extra)]
+    for _id, updated in stamps:
+        parts.append(u"%s@%s" %(_id, updated))
+    etag = hashlib.sha1(u"|".join(parts).encode("utf-8")).hexdigest()
+    last_modified = None
+    if len(stamps) == 1 and not extra and stamps[0][1] is not None:
+        last_modified = to_utc(stamps[0][1])
+    return etag, last_modified
+
+def is_not_modified(request, etag, last_modified=None):
+    """check the ``If-None-Match`` and ``If-Modified-Since`` headers of
+    ``request`` and return ``True`` if the client's copy is still valid.
+    ``If-None-Match`` takes precedence if both are given."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified=None):
+    """set the ``ETag`` and ``Last-Modified`` headers of ``response``"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def not_modified(etag, last_modified=None):
+    """return an empty ``304 Not Modified`` response"""
+    return set_validators(Response(status=304), etag, last_modified)
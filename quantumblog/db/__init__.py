@@ -1,17 +1,105 @@
-from core import *
-from contest import *
-from entry import *
-from comment import *
-from s3store import *
-from user import *
-from fields import *
-from vote import *
-from genres import *
-from events import *
-from mp3extractor import *
-from faq import *
-from sponsors import *
-from branding import *
-from assets import *
-from banners import *
-from winners import *
+"""the database layer of quantumblog.
+
+All public names of the submodules are available directly from this package
+but the submodules are only imported when one of their names is accessed
+for the first time. This way a script only reading users doesn't need to
+import PIL, boto etc. We find out which module defines a name by parsing
+the ``__all__`` lists of the submodules without importing them.
+"""
+
+import ast
+import os
+import sys
+import types
+
+# the submodules in the order names are looked up
+MODULES = [
+    'core', 'contest', 'entry', 'comment', 's3store', 'user', 'fields',
+    'pagination', 'denormalize', 'aggregates', 'search', 'dispatch',
+    'transfer', 'vote', 'genres', 'events', 'mp3extractor', 'faq',
+    'sponsors', 'branding', 'assets', 'banners', 'winners',
+]
+
+def _exported_names(filename):
+    """return the names a module exports by parsing its source. This is
+    either its ``__all__`` list or all public top level names."""
+    f = open(filename)
+    try:
+        tree = ast.parse(f.read(), filename)
+    finally:
+        f.close()
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = [t.id for t in node.targets if isinstance(t, ast.Name)]
+            if "__all__" in targets and isinstance(node.value, (ast.List, ast.Tuple)):
+                return [elt.s for elt in node.value.elts if isinstance(elt, ast.Str)]
+            names.extend(targets)
+        elif isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            names.append(node.name)
+    return [n for n in names if not n.startswith("_")]
+
+class LazyModule(types.ModuleType):
+    """a module importing the submodule defining a name on first access"""
+
+    def _names(self, modname):
+        """return the names exported by the submodule ``modname``. If only
+        the compiled module was deployed we have to import it."""
+        filename = os.path.join(self.__path__[0], modname)
+        if os.path.exists(filename + ".py"):
+            return _exported_names(filename + ".py")
+        if os.path.exists(filename + ".pyc") or os.path.exists(filename + ".pyo"):
+            module = self._load(modname)
+            return getattr(module, "__all__", [n for n in dir(module)
+                                               if not n.startswith("_")])
+        return []
+
+    def _index(self):
+        """return a dictionary mapping names to the submodules defining them.
+        Like with the star imports we used before a later module wins if 
+        several export the same name."""
+        index = self.__dict__.get("_name_index", None)
+        if index is None:
+            index = {}
+            for modname in self.MODULES:
+                for name in self._names(modname):
+                    index[name] = modname
+            self._name_index = index
+        return index
+
+    def _load(self, modname):
+        """import the submodule ``modname``"""
+        __import__("%s.%s" %(self.__name__, modname))
+        return sys.modules["%s.%s" %(self.__name__, modname)]
+
+    def __getattr__(self, name):
+        if name == "__all__":
+            names = []
+            for modname in self.MODULES:
+                for n in self._names(modname):
+                    if n not in names:
+                        names.append(n)
+            self.__all__ = names
+            return names
+        if name.startswith("__"):
+            raise AttributeError(name)
+        modname = self._index().get(name, None)
+        if modname is None:
+            raise AttributeError(name)
+        value = getattr(self._load(modname), name)
+        setattr(self, name, value)
+        return value
+
+def _install():
+    """replace this module with a ``LazyModule``"""
+    old = sys.modules[__name__]
+    module = LazyModule(__name__, __doc__)
+    for attr in ("__file__", "__path__", "__package__"):
+        if hasattr(old, attr):
+            setattr(module, attr, getattr(old, attr))
+    module.MODULES = MODULES
+    sys.modules[__name__] = module
+    # keep the old module alive, otherwise its globals are cleared
+    module._old_module = old
+
+_install()
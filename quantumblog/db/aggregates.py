@@ -0,0 +1,115 @@
+import pymongo
+
+__all__ = ['Aggregate']
+
+class Aggregate(object):
+    """a materialized aggregate counts or sums up the documents of a
+    collection grouped by a field. The results are stored in a sub
+    collection ``<collection>.aggregates.<name>`` containing one document
+    ``{'_id' : group, 'value' : result}`` per group and are updated
+    incrementally whenever a document is stored or removed.
+
+    You define them in the ``aggregates`` list of a ``Collection``::
+
+        aggregates = [
+            Aggregate('votes', 'entry_id'),
+            Aggregate('points', 'entry_id', 'points'),
+        ]
+
+    The first one counts the votes per entry, the second sums up the
+    ``points`` field of all votes per entry. If the records have a workflow
+    only records in one of the ``states`` are taken into account, so moving
+    a record to ``deleted`` removes it from the results.
+    """
+
+    def __init__(self, name, key, value=None, states=[u'active']):
+        """initialize the aggregate
+
+        :param name: the name of the aggregate
+        :param key: the field to group by
+        :param value: the field to sum up or ``None`` to count documents
+        :param states: the workflow states of the documents to take into account
+        """
+        self.name = name
+        self.key = key
+        self.value = value
+        self.states = states
+
+    def contribution(self, doc):
+        """return the tuple ``(group, amount)`` a document contributes
+        or ``None`` if it does not count"""
+        if doc is None:
+            return None
+        if doc.get("workflow", None) is not None and \
+                doc['workflow'] not in self.states:
+            return None
+        group = doc.get(self.key, None)
+        if group is None:
+            return None
+        if self.value is None:
+            return group, 1
+        return group, doc.get(self.value, None) or 0
+
+    @property
+    def fields(self):
+        """return the fields needed to compute a contribution"""
+        fields = [self.key, "workflow"]
+        if self.value is not None:
+            fields.append(self.value)
+        return fields
+
+def aggregate_collection(coll, agg):
+    """return the mongodb collection storing the results of ``agg``"""
+    return coll.collection['aggregates'][agg.name]
+
+def update_aggregates(coll, old, new):
+    """update all aggregates of ``coll`` for a document changing from ``old``
+    to ``new``. Both can be ``None`` for new or removed documents."""
+    for agg in coll.aggregates:
+        before = agg.contribution(old)
+        after = agg.contribution(new)
+        if before == after:
+            continue
+        results = aggregate_collection(coll, agg)
+        if before is not None:
+            results.update({'_id' : before[0]},
+                           {'$inc' : {'value' : -before[1]}}, upsert = True)
+        if after is not None:
+            results.update({'_id' : after[0]},
+                           {'$inc' : {'value' : after[1]}}, upsert = True)
+
+def ensure_aggregate_index(coll, agg):
+    """create the index on the values of ``agg`` used for rankings"""
+    aggregate_collection(coll, agg).ensure_index([('value', pymongo.DESCENDING)])
+
+def rebuild_aggregate(coll, agg, batch_size=1000):
+    """compute ``agg`` from scratch in one streaming pass over ``coll``. The
+    results are written to a temporary collection which then replaces the
+    old results so readers never see a partial result.
+
+    Writes to ``coll`` must be paused while this runs. The incremental
+    updates of documents stored or removed during the rebuild go to the
+    old results which are then replaced, so they would be lost."""
+    results = {}
+    for doc in coll.collection.find({}, agg.fields).batch_size(batch_size):
+        c = agg.contribution(doc)
+        if c is not None:
+            results[c[0]] = results.get(c[0], 0) + c[1]
+
+    target = aggregate_collection(coll, agg)
+    tmp = coll.collection['aggregates'][agg.name + "_rebuild"]
+    tmp.drop()
+    batch = []
+    for group, value in results.iteritems():
+        batch.append({'_id' : group, 'value' : value})
+        if len(batch) >= batch_size:
+            tmp.insert(batch)
+            batch = []
+    if batch:
+        tmp.insert(batch)
+    if results:
+        tmp.rename(target.name, dropTarget = True)
+    else:
+        target.drop()
+    ensure_aggregate_index(coll, agg)
+    return len(results)
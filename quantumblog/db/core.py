@@ -13,6 +13,13 @@ from starflyer.processors import *
 from starflyer import processors as p
 import starflyer
 
+from pagination import Page, encode_token, decode_token, keyset_spec
+from denormalize import group_by_relation, fill_denormalized, \
+                        refresh_denormalized, DenormalizationListener
+from aggregates import update_aggregates, rebuild_aggregate, \
+                       aggregate_collection, ensure_aggregate_index
+from search import SearchIndex, SearchListener
+
 __all__ = ['DataError', 'Record', 'Collection', 'View']
 
 class DataError(Exception):
@@ -43,6 +50,8 @@ class Record(dict):
     from it and define the ``fields`` dict as class variable."""
 
     fields = {} # name -> Field()
+    denormalized = {} # name -> Denormalized()
+    searchable = {} # name -> weight for full text search
     in_processors = [] # runs when data enters mongodb
     out_processors = [] # runs when data leaves mongodb
 
@@ -52,6 +61,7 @@ class Record(dict):
         u'deleted' : [],
     }
     initial_workflow_state = u"active"
+    visible_workflow_states = [u"active"] # returned by default in queries
 
     def __init__(self, data = None, 
                        coll = None, 
@@ -153,6 +163,10 @@ class Record(dict):
         if errors != {}:
             raise DataError(errors, results)
 
+        # denormalized values are simply copied
+        for name in cls.denormalized:
+            results[name] = data.get(name, None)
+
         # now handle dates
         results['_updated'] = data.get('_updated', None)
         results['_created'] = data.get('_created', None)
@@ -224,6 +238,9 @@ class Collection(object):
     data_cls = None
     in_processors = []
     use_objectids = True # we use ObjectIds for identifying, not strings
+    aggregates = [] # list of Aggregate()
+    indexes = [] # list of index specs, e.g. [('date', pymongo.DESCENDING)]
+    filter_workflow = True # only return records in a visible workflow state
 
     def __init__(self, collection, storages={}, settings = {}, **kw):
         """initialize the Collection class with a ``collection`` object and
@@ -232,6 +249,7 @@ class Collection(object):
         self.storages = storages
         self.settings = settings
         self.kw = kw
+        self._search_index = None
 
     def _mkobjid(self, _id):
         """convert string to object id if it is not already one"""
@@ -239,11 +257,35 @@ class Collection(object):
             _id = pymongo.objectid.ObjectId(_id)
         return _id
 
-    def get(self, _id):
-        """return an object by id or ``None`` if the object wasn't found"""
+    def workflow_spec(self, all_states=False):
+        """return the query spec restricting queries to records in one of 
+        the ``visible_workflow_states`` of the data class. It's empty if
+        the records have no workflow, ``filter_workflow`` is ``False`` or
+        ``all_states`` is given."""
+        if all_states or not self.filter_workflow \
+                or not self.data_cls.fields.has_key("workflow"):
+            return {}
+        states = self.data_cls.visible_workflow_states
+        if len(states) == 1:
+            # a plain match can use the partial indexes
+            return {'workflow' : states[0]}
+        return {'workflow' : {'$in' : states}}
+
+    def _filtered(self, spec, all_states=False):
+        """return a copy of ``spec`` with the workflow filter applied unless
+        ``spec`` filters by workflow itself"""
+        spec = copy.copy(spec)
+        if not spec.has_key("workflow"):
+            spec.update(self.workflow_spec(all_states))
+        return spec
+
+    def get(self, _id, all_states=False):
+        """return an object by id or ``None`` if the object wasn't found. 
+        Records not in a visible workflow state are only returned if 
+        ``all_states`` is given."""
         if self.use_objectids:
             _id = self._mkobjid(_id)
-        values = self.collection.find_one({'_id' : _id})
+        values = self.collection.find_one(self._filtered({'_id' : _id}, all_states))
         if values is None:
             return None
         # now pass values through processors and fields
@@ -255,13 +297,29 @@ class Collection(object):
 
     @property
     def query(self):
-        """return a mongoquery.Query object with collection and instantiation pre-filled"""
+        """return a mongoquery.Query object with collection and instantiation 
+        pre-filled. It only returns records in a visible workflow state."""
+        return self.query_all_states.update(**self.workflow_spec())
+
+    @property
+    def query_all_states(self):
+        """return a mongoquery.Query object like ``query`` but without the
+        workflow filter"""
         return mongoquery.Query().coll(self.collection).call(self.data_cls.from_mongo, coll=self)
 
     @property
     def all(self):
-        """return all items for now"""
-        data = self.collection.find({})
+        """return all items in a visible workflow state"""
+        return self._find({})
+
+    @property
+    def all_states(self):
+        """return all items regardless of their workflow state"""
+        return self._find({}, True)
+
+    def _find(self, spec, all_states=False):
+        """return the list of objects matching ``spec``"""
+        data = self.collection.find(self._filtered(spec, all_states))
         objs = []
         for values in data:
             obj = self.data_cls.from_mongo(values, self)
@@ -269,6 +327,78 @@ class Collection(object):
             objs.append(obj)
         return objs
 
+    def stamps(self, spec={}, sort_key=None, direction=pymongo.DESCENDING,
+                     limit=0, all_states=False):
+        """return the ``_id`` and ``_updated`` values of the records matching
+        ``spec`` as a list of dictionaries without retrieving or decoding
+        the records themselves. Use it to compute validators for conditional
+        requests.
+
+        :param spec: the query spec
+        :param sort_key: an optional field to sort by
+        :param direction: the sort direction
+        :param limit: the maximum number of results or 0 for all
+        :param all_states: also include records not in a visible workflow state
+        """
+        cursor = self.collection.find(self._filtered(spec, all_states), 
+                                      ['_id', '_updated'])
+        if sort_key is not None:
+            cursor = cursor.sort(sort_key, direction)
+        return list(cursor.limit(limit))
+
+    def paginate(self, spec={}, sort_key="_id", 
+                       direction=pymongo.DESCENDING, 
+                       limit=20, token=None, all_states=False):
+        """return a page of objects sorted by ``sort_key`` and ``_id``.
+
+        Instead of using skip/limit we remember the position of the last
+        object of a page in an opaque continuation token. Passing it in
+        again returns the next page by using a range query on the sort key
+        which is as fast for the last page as for the first one (given an
+        index on ``(sort_key, _id)``).
+
+        :param spec: an additional query spec for filtering the objects
+        :param sort_key: the name of the field to sort by. ``_id`` is always
+            used as a tiebreaker.
+        :param direction: ``pymongo.DESCENDING`` or ``pymongo.ASCENDING``
+        :param limit: the number of objects per page
+        :param token: the ``next_token`` of the previous page or ``None``
+            for the first page
+        :param all_states: also return records not in a visible workflow state
+        :return: a ``Page`` instance with the objects on this page and the
+            token for the next one. Raises a ``DataError`` if the token
+            is invalid.
+        """
+        spec = self._filtered(spec, all_states)
+        if token is not None:
+            try:
+                value, _id = decode_token(token)
+            except ValueError, e:
+                e = p.Error("invalid_token", str(e))
+                raise DataError(errors={'token' : e})
+            range_spec = keyset_spec(sort_key, value, _id, direction)
+            if spec.has_key('$or') or spec.has_key(sort_key) or spec.has_key('_id'):
+                spec = {'$and' : [spec, range_spec]}
+            else:
+                spec.update(range_spec)
+        sort = [(sort_key, direction)]
+        if sort_key != "_id":
+            sort.append(("_id", direction))
+
+        # fetch one more to find out if there is another page
+        data = list(self.collection.find(spec).sort(sort).limit(limit+1))
+        next_token = None
+        if len(data) > limit:
+            data = data[:limit]
+            last = data[-1]
+            next_token = encode_token(last.get(sort_key), last['_id'])
+        objs = []
+        for values in data:
+            obj = self.data_cls.from_mongo(values, self)
+            obj.set_collection(self)
+            objs.append(obj)
+        return Page(objs, next_token)
+
     def put(self, obj, **ctx_attrs):
         """store an object inside mongodb. This will use upserts."""
         # run in processors
@@ -286,21 +416,163 @@ class Collection(object):
             errors[e.name] = e
         if errors != {}:
             raise DataError(errors, values)
-        n = self.__class__.__name__.lower()
-        self.trigger("db.%s.put:before" %n, {'coll' : self, 'values': values})
+        if self.data_cls.denormalized:
+            fill_denormalized(self, values)
+        self.trigger(self.event_name("put:before"), {'coll' : self, 'values': values})
+        old = None
+        if self.aggregates and values.has_key('_id'):
+            old = self.collection.find_one({'_id' : values['_id']})
         values['_id'] = self.collection.save(values, True)
+        if self.aggregates:
+            update_aggregates(self, old, values)
         obj = self.data_cls.from_mongo(values, self)
         obj.set_collection(self)
-        self.trigger("db.%s.put:after" %n, {'coll' : self, 'obj': obj})
+        self.trigger(self.event_name("put:after"), {'coll' : self, 'obj': obj})
         return obj
 
+    def event_name(self, action):
+        """return the name of the event triggered for ``action``, e.g.
+        ``db.users.put:after`` for ``put:after`` in the ``Users`` collection.
+        Besides ``put`` and ``remove`` there is ``update:after`` which is
+        triggered after bulk writes bypassing ``put()``."""
+        return "db.%s.%s" %(self.__class__.__name__.lower(), action)
+
     def trigger(self, name, e={}):
-        """trigger an event"""
-        self.settings.events.handle(name, e, self.settings)
+        """trigger an event. Collections without ``events`` in their
+        settings (e.g. in scripts or tests) don't trigger anything."""
+        events = self.settings.get("events", None)
+        if events is not None:
+            events.handle(name, e, self.settings)
+
+    def setup_listeners(self):
+        """connect the listeners this collection needs to ``settings.events``.
+        This is called by ``connect_listeners()`` once all collections are
+        set up. Override it to add your own but call the super method."""
+        relations = group_by_relation(self.data_cls.denormalized)
+        for (source, key, remote_key), fields in relations.items():
+            source_coll = self.settings[source]
+            listener = DenormalizationListener(self, key, remote_key, fields)
+            self.settings.events.connect(source_coll.event_name("put:after"), 
+                                         listener)
+        if self.data_cls.searchable:
+            # indexing can take a while so we don't want to wait for it
+            listener = SearchListener(self.search_index)
+            self.settings.events.connect(self.event_name("put:after"), listener, 
+                                         asynchronous = True)
+            self.settings.events.connect(self.event_name("remove:after"), listener,
+                                         asynchronous = True)
+
+    @property
+    def search_index(self):
+        """return the ``SearchIndex`` for the ``searchable`` fields"""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self)
+        return self._search_index
+
+    def search(self, query, limit=20):
+        """return a list of records matching the full text ``query``, the 
+        best matches first"""
+        return self.search_index.search(query, limit)
 
     def remove(self, _id):
         """remove a given object from the database"""
+        old = None
+        if self.aggregates:
+            old = self.collection.find_one({'_id' : _id})
         self.collection.remove({'_id' : _id})
+        if old is not None:
+            update_aggregates(self, old, None)
+        self.trigger(self.event_name("remove:after"), {'coll' : self, '_id' : _id})
+
+    def ensure_indexes(self):
+        """create the ``indexes`` of this collection. If the workflow filter 
+        applies they are created as partial indexes only containing records
+        in the visible workflow state so deleted records don't bloat them.
+        We also create the indexes the ``aggregates`` need for rankings and
+        the ones of the search index."""
+        wf_spec = self.workflow_spec()
+        for keys in self.indexes:
+            kw = {}
+            if wf_spec and not isinstance(wf_spec['workflow'], dict):
+                kw['partialFilterExpression'] = wf_spec
+            self.collection.ensure_index(keys, **kw)
+        for agg in self.aggregates:
+            ensure_aggregate_index(self, agg)
+        if self.data_cls.searchable:
+            self.search_index.ensure_indexes()
+
+    def archive_deleted(self, older_than=datetime.timedelta(days=30), 
+                              batch_size=100):
+        """move records which are not in a visible workflow state and haven't
+        been updated for ``older_than`` to the ``<collection>.archive`` 
+        collection. 
+
+        :param older_than: a ``timedelta`` defining the minimum age
+        :param batch_size: the number of records to move at once
+        :return: the number of records moved
+        """
+        wf_spec = self.workflow_spec()
+        if not wf_spec:
+            return 0
+        spec = {
+            'workflow' : {'$nin' : self.data_cls.visible_workflow_states},
+            '_updated' : {'$lt' : datetime.datetime.now() - older_than},
+        }
+        archive = self.collection['archive']
+        moved = 0
+        while True:
+            docs = list(self.collection.find(spec).limit(batch_size))
+            if not docs:
+                break
+            for doc in docs:
+                archive.save(doc, True) # save in case we got interrupted before
+            self.collection.remove({'_id' : {'$in' : [d['_id'] for d in docs]}})
+            moved = moved + len(docs)
+        if moved:
+            self.trigger(self.event_name("update:after"), {'coll' : self})
+        return moved
+
+    def refresh_denormalized(self, batch_size=1000):
+        """recompute the denormalized fields of all records, e.g. after an
+        import. Returns the number of records updated."""
+        return refresh_denormalized(self, batch_size)
+
+    def _get_aggregate(self, name):
+        """return the ``Aggregate`` named ``name``"""
+        for agg in self.aggregates:
+            if agg.name == name:
+                return agg
+        raise KeyError(name)
+
+    def aggregated(self, name, group):
+        """return the precomputed value of the aggregate ``name`` for
+        ``group`` or 0 if there is none"""
+        agg = self._get_aggregate(name)
+        doc = aggregate_collection(self, agg).find_one({'_id' : group})
+        if doc is None:
+            return 0
+        return doc['value']
+
+    def ranking(self, name, limit=10):
+        """return the groups with the highest values of the aggregate
+        ``name`` as a list of ``(group, value)`` tuples"""
+        agg = self._get_aggregate(name)
+        results = aggregate_collection(self, agg)
+        docs = results.find({'value' : {'$gt' : 0}}) \
+                      .sort('value', pymongo.DESCENDING).limit(limit)
+        return [(doc['_id'], doc['value']) for doc in docs]
+
+    def rebuild_aggregates(self, names=None, batch_size=1000):
+        """recompute aggregates from scratch, e.g. after adding a new one.
+        Pause all writes to this collection while this runs, otherwise
+        updates made in the meantime are lost (see ``rebuild_aggregate()``).
+
+        :param names: the names of the aggregates to rebuild or ``None`` for all
+        :param batch_size: the number of documents to fetch and write at once
+        """
+        for agg in self.aggregates:
+            if names is None or agg.name in names:
+                rebuild_aggregate(self, agg, batch_size)
 
 
 class View(object):
@@ -361,6 +633,22 @@ class View(object):
         # but only really a problem with big sets to fit in memory
         # also we'd need to inject some different function into the query
         results = list(query()) # unfortunately we cannot rewind a cursor
+        return self.join(results)
+
+    def page(self, coll, **kw):
+        """return a page of combined results from ``coll`` using keyset
+        pagination. All keyword arguments are passed to 
+        ``Collection.paginate()``, so the original objects are retrieved
+        with one range query and each mapping adds one ``$in`` query.
+
+        :param coll: the ``Collection`` to retrieve the original objects from
+        :return: a ``Page`` instance containing the combined dictionaries
+        """
+        page = coll.paginate(**kw)
+        return Page(self.join(page), page.next_token)
+
+    def join(self, results):
+        """combine a list of objects with their related objects"""
         map_results = {}
         for name, info in self.mapping.items():
             n1, coll, n2 = info
@@ -380,7 +668,7 @@ class View(object):
             }
             for name, info in self.mapping.items():
                 n1, coll, n2 = info
-                d[name] = map_results[name][r[n1]]
+                d[name] = map_results[name].get(r[n1], None)
             final_results.append(d)
         return final_results
 
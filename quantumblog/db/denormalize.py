@@ -0,0 +1,131 @@
+import datetime
+
+__all__ = ['Denormalized']
+
+class Denormalized(object):
+    """a denormalized field copies a value from a related document in
+    another collection into a record. This way listings do not need a
+    ``View`` to retrieve e.g. the name of an entry's author.
+
+    You define them in the ``denormalized`` dict of a ``Record``::
+
+        denormalized = {
+            'author_name' : Denormalized('users', 'user_id', 'username'),
+        }
+
+    Here ``users`` is the name of the collection in the settings, ``user_id``
+    the field in the record pointing to the related document and ``username``
+    the field in the related document to copy. The values are filled in
+    when the record is stored and updated whenever the related document
+    changes (see ``Collection.setup_listeners()``).
+    """
+
+    def __init__(self, source, key, field, remote_key="_id"):
+        """initialize the denormalized field
+
+        :param source: the name of the related collection in the settings
+        :param key: the field in the record referencing the related document
+        :param field: the field in the related document to copy
+        :param remote_key: the field in the related document ``key`` refers to
+        """
+        self.source = source
+        self.key = key
+        self.field = field
+        self.remote_key = remote_key
+
+    @property
+    def relation(self):
+        """return a tuple identifying the relation this field uses. Fields
+        with the same relation can be retrieved and updated together."""
+        return (self.source, self.key, self.remote_key)
+
+def group_by_relation(denormalized):
+    """return a dictionary mapping relations to dictionaries of the
+    ``Denormalized`` fields using it"""
+    relations = {}
+    for name, d in denormalized.items():
+        relations.setdefault(d.relation, {})[name] = d
+    return relations
+
+def fill_denormalized(coll, values):
+    """fill in the denormalized fields of the record class of ``coll`` into
+    the ``values`` about to be stored. We do one query per relation."""
+    relations = group_by_relation(coll.data_cls.denormalized)
+    for (source, key, remote_key), fields in relations.items():
+        ref = values.get(key, None)
+        doc = None
+        if ref is not None:
+            source_coll = coll.settings[source]
+            if remote_key == "_id" and source_coll.use_objectids:
+                ref = source_coll._mkobjid(ref)
+            doc = source_coll.collection.find_one({remote_key : ref})
+        for name, d in fields.items():
+            values[name] = doc.get(d.field, None) if doc is not None else None
+    return values
+
+def refresh_denormalized(coll, batch_size=1000):
+    """recompute the denormalized fields of all documents in ``coll``, e.g.
+    after importing data without triggering events. Only documents with
+    changed values are written.
+
+    :return: the number of documents updated
+    """
+    names = coll.data_cls.denormalized.keys()
+    keys = [d.key for d in coll.data_cls.denormalized.values()]
+    n = 0
+    for doc in coll.collection.find({}, keys + names).batch_size(batch_size):
+        values = fill_denormalized(coll, dict(doc))
+        changed = dict([(name, values[name]) for name in names
+                        if doc.get(name, None) != values[name]])
+        if changed:
+            changed['_updated'] = datetime.datetime.now()
+            coll.collection.update({'_id' : doc['_id']}, {'$set' : changed})
+            n = n + 1
+    if n:
+        coll.trigger(coll.event_name("update:after"), {'coll' : coll})
+    return n
+
+class DenormalizationListener(object):
+    """listens to ``db.<name>.put:after`` events of a related collection and
+    updates all dependent documents in one batched update"""
+
+    def __init__(self, coll, key, remote_key, fields):
+        """initialize the listener
+
+        :param coll: the dependent ``Collection`` to update
+        :param key: the field in the dependent documents referencing the
+            related document
+        :param remote_key: the field in the related document ``key`` refers to
+        :param fields: a dictionary mapping names to ``Denormalized`` instances
+        """
+        self.coll = coll
+        self.key = key
+        self.remote_key = remote_key
+        self.fields = fields
+        self.listener_id = "denormalize:%s.%s" %(coll.collection.name, key)
+
+    def __call__(self, name, e, settings):
+        """update the dependent documents of the stored object"""
+        obj = e['obj']
+        ref = obj.get(self.remote_key, None)
+        if ref is None:
+            return
+        refs = [ref]
+        if self.remote_key == "_id":
+            refs.append(unicode(ref)) # we might reference it by string
+        new_values = {}
+        changed = []
+        for n, d in self.fields.items():
+            new_values[n] = obj.get(d.field, None)
+            changed.append({n : {'$ne' : new_values[n]}})
+
+        # only touch documents which are not up to date already
+        spec = {self.key : {'$in' : refs}, '$or' : changed}
+        new_values['_updated'] = datetime.datetime.now()
+        result = self.coll.collection.update(spec, {'$set' : new_values},
+                                             multi = True, safe = True)
+        # the batched update bypasses put() so announce it for caches, but
+        # only if it changed something
+        if result and result.get('n', 0):
+            self.coll.trigger(self.coll.event_name("update:after"), 
+                              {'coll' : self.coll})
@@ -0,0 +1,355 @@
+import atexit
+import datetime
+import Queue
+import threading
+import time
+import traceback
+
+from core import Collection
+
+__all__ = ['Events', 'DurableQueue', 'connect_listeners', 'get_collections']
+
+SYNC = "sync"
+ASYNC = "async"
+DURABLE = "durable"
+
+def listener_id(listener):
+    """return a name identifying ``listener``. Listeners can define it
+    themselves in a ``listener_id`` attribute which is needed if more than
+    one instance of a class is connected to the same event."""
+    if hasattr(listener, "listener_id"):
+        return listener.listener_id
+    name = getattr(listener, "__name__", listener.__class__.__name__)
+    return "%s.%s" %(listener.__module__, name)
+
+def event_ref(e):
+    """return the id of the record an event is about or ``None``"""
+    obj = e.get("obj", None)
+    if obj is not None:
+        return obj['_id']
+    return e.get("_id", None)
+
+def load_event(coll, ref):
+    """recreate the event dictionary for the record ``ref`` of ``coll`` from
+    its current state. If the record is gone it only contains its ``_id``
+    like for ``remove:after`` events."""
+    e = {'coll' : coll}
+    obj = None
+    if ref is not None:
+        obj = coll.get(ref, all_states=True)
+    if obj is not None:
+        e['obj'] = obj
+    else:
+        e['_id'] = ref
+    return e
+
+class WorkerPool(object):
+    """a bounded pool of threads calling functions in the background. Every
+    thread has its own queue and calls submitted with the same key always
+    go to the same thread, so they run one after another in the order
+    they were submitted. If the queue is full the caller waits so we slow
+    down writers instead of losing events. For the same reason we wait for
+    all queued calls when the process exits."""
+
+    def __init__(self, size=4, queue_size=1000):
+        self.size = size
+        self.queue_size = max(1, queue_size / size) # per thread
+        self.queues = []
+        self.threads = []
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def _start(self):
+        """start the worker threads if they are not running yet"""
+        self.lock.acquire()
+        try:
+            if not self.threads:
+                atexit.register(self.join)
+            while len(self.threads) < self.size:
+                queue = Queue.Queue(self.queue_size)
+                t = threading.Thread(target=self._work, args=(queue,))
+                t.setDaemon(True)
+                t.start()
+                self.queues.append(queue)
+                self.threads.append(t)
+        finally:
+            self.lock.release()
+
+    def _work(self, queue):
+        while True:
+            func, args = queue.get()
+            try:
+                func(*args)
+            finally:
+                queue.task_done()
+
+    def submit(self, key, func, *args):
+        """call ``func(*args)`` in one of the worker threads. Calls with the
+        same ``key`` are run by the same thread, calls with the key ``None``
+        are distributed over all threads."""
+        if len(self.threads) < self.size:
+            self._start()
+        if key is None:
+            self.counter = self.counter + 1
+            queue = self.queues[self.counter % self.size]
+        else:
+            queue = self.queues[hash(unicode(key)) % self.size]
+        if threading.currentThread() in self.threads:
+            # a listener triggering events. Waiting for our own queue
+            # could block forever so we run it right away if it's full
+            try:
+                queue.put_nowait((func, args))
+            except Queue.Full:
+                func(*args)
+            return
+        queue.put((func, args))
+
+    def join(self):
+        """wait until all submitted calls are done"""
+        for queue in self.queues:
+            queue.join()
+
+class DurableQueue(object):
+    """a queue for events stored in a MongoDB collection. Jobs are processed
+    by ``process()``, usually called from the ``process_events`` script,
+    and retried with an exponential backoff if the listener fails.
+
+    As objects can't be stored we only store the name of the collection and
+    the id of the object and retrieve it again when processing the job. If
+    the object is gone by then the listener gets its ``_id`` instead of the
+    ``obj`` like for ``remove:after`` events.
+    """
+
+    def __init__(self, collection, max_attempts=5):
+        """initialize the queue
+
+        :param collection: the MongoDB collection to store the jobs in
+        :param max_attempts: how often to try a job before marking it as failed
+        """
+        self.collection = collection
+        self.max_attempts = max_attempts
+
+    def ensure_indexes(self):
+        """create the index needed to find the next job"""
+        self.collection.ensure_index([('state', 1), ('run_at', 1)])
+
+    def push(self, name, lid, e):
+        """store a job calling the listener ``lid`` for the event ``name``"""
+        now = datetime.datetime.utcnow()
+        self.collection.insert({
+            'event' : name,
+            'listener' : lid,
+            'coll' : e['coll'].collection.name,
+            'ref' : event_ref(e),
+            'state' : u"pending",
+            'attempts' : 0,
+            'created' : now,
+            'run_at' : now,
+        })
+
+    def _event(self, job, settings):
+        """recreate the event dictionary for a job"""
+        for coll in get_collections(settings).values():
+            if coll.collection.name == job['coll']:
+                break
+        else:
+            raise KeyError("unknown collection %s" %job['coll'])
+        return load_event(coll, job['ref'])
+
+    def process(self, events, settings, limit=100):
+        """process up to ``limit`` pending jobs
+
+        :return: the number of jobs processed
+        """
+        n = 0
+        while n < limit:
+            now = datetime.datetime.utcnow()
+            job = self.collection.find_and_modify(
+                query = {'state' : u"pending", 'run_at' : {'$lte' : now}},
+                update = {'$set' : {'state' : u"running", 'started' : now},
+                          '$inc' : {'attempts' : 1}},
+                sort = {'run_at' : 1},
+                new = True)
+            if job is None:
+                break
+            n = n + 1
+            try:
+                listener = events.durable_listeners[job['listener']]
+                events._call(job['event'], listener, self._event(job, settings), settings)
+            except Exception, e:
+                update = {'error' : traceback.format_exc()}
+                if job['attempts'] >= self.max_attempts:
+                    update['state'] = u"failed"
+                else:
+                    update['state'] = u"pending"
+                    delay = datetime.timedelta(seconds = 2 ** job['attempts'])
+                    update['run_at'] = datetime.datetime.utcnow() + delay
+                self.collection.update({'_id' : job['_id']}, {'$set' : update})
+                continue
+            self.collection.remove({'_id' : job['_id']})
+        return n
+
+    def requeue_stale(self, timeout=datetime.timedelta(minutes=10)):
+        """put jobs back into the queue which are running for longer than
+        ``timeout``, e.g. because the worker got killed. Jobs which used up
+        their attempts are marked as failed instead so a job crashing the
+        worker isn't retried forever."""
+        cutoff = datetime.datetime.utcnow() - timeout
+        spec = {'state' : u"running", 'started' : {'$lt' : cutoff}}
+        self.collection.update(
+            dict(spec, attempts = {'$gte' : self.max_attempts}),
+            {'$set' : {'state' : u"failed", 'error' : u"timed out"}}, 
+            multi = True)
+        self.collection.update(spec, {'$set' : {'state' : u"pending"}}, 
+                               multi = True)
+
+class Events(object):
+    """a simple event registry. Listeners are connected to an event name
+    and called with the event name, the event dictionary and the settings
+    whenever ``handle()`` is called for that name. ``Collection.trigger()``
+    uses this via ``settings.events``.
+
+    Listeners are called synchronously by default. Listeners to events
+    which happen after the fact (e.g. ``put:after``) can also be connected
+    as ``asynchronous``, in which case they are called by a thread of the
+    worker pool, or as ``durable``, in which case they are stored in the
+    ``DurableQueue`` in ``queue`` and processed by a separate process.
+
+    For events about a record asynchronous listeners don't get the object
+    the caller might still change. The worker reads the record again
+    instead, like the durable queue does, and all events of one record
+    are handled by the same thread in order.
+
+    The time spent in each listener is recorded and can be retrieved with
+    ``stats()``.
+    """
+
+    def __init__(self, pool_size=4, queue_size=1000, queue=None):
+        """initialize the registry
+
+        :param pool_size: the number of threads for asynchronous listeners
+        :param queue_size: the number of calls the pool can queue up
+        :param queue: the ``DurableQueue`` to use for durable listeners
+        """
+        self.listeners = {} # name -> [(listener, mode)]
+        self.durable_listeners = {} # listener id -> listener
+        self.pool = WorkerPool(pool_size, queue_size)
+        self.queue = queue
+        self.timings = {} # (name, listener id) -> stats
+        self.lock = threading.Lock()
+
+    def connect(self, name, listener, asynchronous=False, durable=False):
+        """connect a ``listener`` to the event ``name``
+
+        :param name: the name of the event
+        :param listener: a callable taking the event name, the event
+            dictionary and the settings
+        :param asynchronous: call the listener in a background thread
+        :param durable: call the listener via the durable queue
+        """
+        mode = SYNC
+        if asynchronous or durable:
+            if name.endswith(":before"):
+                raise ValueError("listeners to %s need to be synchronous" %name)
+            mode = DURABLE if durable else ASYNC
+        if mode == DURABLE:
+            if self.queue is None:
+                raise ValueError("no durable queue configured")
+            self.durable_listeners[listener_id(listener)] = listener
+        self.listeners.setdefault(name, []).append((listener, mode))
+
+    def disconnect(self, name, listener):
+        """remove a ``listener`` from the event ``name`` again"""
+        self.listeners[name] = [(l, mode) for l, mode in self.listeners.get(name, [])
+                                if l != listener]
+
+    def handle(self, name, e={}, settings=None):
+        """call all listeners for the event ``name``"""
+        for listener, mode in self.listeners.get(name, []):
+            if mode == SYNC:
+                self._call(name, listener, e, settings)
+            elif mode == ASYNC:
+                ref = event_ref(e)
+                if e.has_key("coll") and ref is not None:
+                    self.pool.submit(ref, self._call_reloaded, name, listener,
+                                     e['coll'], ref, settings)
+                else:
+                    self.pool.submit(None, self._call_logged, name, listener,
+                                     dict(e), settings)
+            else:
+                self.queue.push(name, listener_id(listener), e)
+
+    def _call(self, name, listener, e, settings):
+        """call a listener and record the time it took"""
+        start = time.time()
+        failed = True
+        try:
+            listener(name, e, settings)
+            failed = False
+        finally:
+            self._record(name, listener, time.time() - start, failed)
+
+    def _call_logged(self, name, listener, e, settings):
+        """call a listener in a background thread and log errors"""
+        try:
+            self._call(name, listener, e, settings)
+        except Exception, exc:
+            if settings is not None and settings.has_key("log"):
+                settings.log.exception("listener %s failed for %s"
+                                       %(listener_id(listener), name))
+
+    def _call_reloaded(self, name, listener, coll, ref, settings):
+        """call a listener in a background thread with the current state
+        of the record ``ref``"""
+        try:
+            e = load_event(coll, ref)
+        except Exception, exc:
+            if settings is not None and settings.has_key("log"):
+                settings.log.exception("loading %s failed for %s" %(ref, name))
+            return
+        self._call_logged(name, listener, e, settings)
+
+    def _record(self, name, listener, duration, failed):
+        self.lock.acquire()
+        try:
+            key = (name, listener_id(listener))
+            t = self.timings.setdefault(key,
+                    {'calls' : 0, 'total' : 0.0, 'max' : 0.0, 'errors' : 0})
+            t['calls'] = t['calls'] + 1
+            t['total'] = t['total'] + duration
+            t['max'] = max(t['max'], duration)
+            if failed:
+                t['errors'] = t['errors'] + 1
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """return the timings of all listeners, the slowest first. Each entry
+        is a dictionary with the ``event``, the ``listener`` id, the number of
+        ``calls`` and ``errors`` and the ``total``, ``mean`` and ``max`` time
+        in seconds."""
+        self.lock.acquire()
+        try:
+            stats = []
+            for (name, lid), t in self.timings.items():
+                s = dict(t, event=name, listener=lid)
+                s['mean'] = t['total'] / t['calls']
+                stats.append(s)
+        finally:
+            self.lock.release()
+        stats.sort(key=lambda s: s['total'], reverse=True)
+        return stats
+
+def get_collections(settings):
+    """return a dictionary of all collections stored in ``settings``"""
+    colls = {}
+    for name, value in settings.items():
+        if isinstance(value, Collection):
+            colls[name] = value
+    return colls
+
+def connect_listeners(settings):
+    """connect the listeners of all collections stored in ``settings``. Call
+    this once all collections have been set up."""
+    for coll in get_collections(settings).values():
+        coll.setup_listeners()
@@ -2,10 +2,8 @@ import copy
 import uuid
 from cStringIO import StringIO
 from starflyer.processors import *
-import PIL
-import PIL.Image
-from PIL import ImageFilter
-from PIL import ImageOps
+
+# PIL is imported by ``ImageField`` when it's needed to keep imports fast
 
 __all__ = ['Field', 'FileField', 'ImageField', 'FileProxy']
 
@@ -316,6 +314,7 @@ class ImageField(Field):
         sizes = {}
         filename = unicode(uuid.uuid4())
         fp.seek(0)
+        import PIL.Image
         try:
             image = PIL.Image.open(fp)
         except Exception, e:
@@ -374,11 +373,15 @@ class ImageField(Field):
 
     def _square(self, img, 
                      width=None, height=None, 
-                     method=PIL.Image.ANTIALIAS, 
+                     method=None, 
                      bleed=0.0, centering=(0.5,0.5), **kw):
         """return a an image of exactly the size ``width`` and ``height`` by 
-        resizing and cropping it"""
+        resizing and cropping it. ``method`` defaults to antialiasing."""
+        import PIL.Image
+        from PIL import ImageOps
         assert width is not None, "please provide a width"
+        if method is None:
+            method = PIL.Image.ANTIALIAS
         if height is None:
             height = width
 
@@ -392,6 +395,7 @@ class ImageField(Field):
         """scale an image to fit to either width or height. 
         If you give both the biggest possible resize will be done. 
         Aspect ratio is always maintained"""
+        import PIL.Image
         
         w,h = img.size
         aspect = h/w
@@ -0,0 +1,86 @@
+import base64
+import datetime
+import json
+
+import pymongo
+import pymongo.objectid
+
+try:
+    from bson.errors import InvalidId
+except ImportError:
+    from pymongo.errors import InvalidId
+
+__all__ = ['Page', 'encode_token', 'decode_token', 'keyset_spec']
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+class Page(list):
+    """a page of results as returned by ``Collection.paginate()``. It's a
+    list of the items on this page and additionally stores the
+    continuation token for the next page in ``next_token``. If there are
+    no more results ``next_token`` is ``None``."""
+
+    def __init__(self, items=[], next_token=None):
+        super(Page, self).__init__(items)
+        self.next_token = next_token
+
+    @property
+    def has_more(self):
+        """return whether there is another page after this one"""
+        return self.next_token is not None
+
+def _encode_value(v):
+    """convert a value from mongo to something we can store in JSON"""
+    if isinstance(v, pymongo.objectid.ObjectId):
+        return {'$oid' : str(v)}
+    if isinstance(v, datetime.datetime):
+        return {'$date' : v.strftime(DATE_FORMAT)}
+    return v
+
+def _decode_value(v):
+    """convert a value from ``_encode_value()`` back"""
+    if isinstance(v, dict):
+        if v.has_key('$oid'):
+            return pymongo.objectid.ObjectId(v['$oid'])
+        if v.has_key('$date'):
+            return datetime.datetime.strptime(v['$date'], DATE_FORMAT)
+    return v
+
+def encode_token(value, _id):
+    """return an opaque continuation token for the position given by
+    the sort key ``value`` and the ``_id`` of the last document on a page"""
+    data = json.dumps([_encode_value(value), _encode_value(_id)])
+    return base64.urlsafe_b64encode(data).rstrip("=")
+
+def decode_token(token):
+    """decode a token created by ``encode_token()`` and return the
+    tuple ``(value, _id)``. Raises a ``ValueError`` if the token is
+    invalid."""
+    try:
+        token = str(token)
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        value, _id = json.loads(data)
+        return _decode_value(value), _decode_value(_id)
+    except (TypeError, ValueError, UnicodeError, InvalidId), e:
+        raise ValueError("invalid continuation token: %s" %token)
+
+def keyset_spec(sort_key, value, _id, direction=pymongo.DESCENDING):
+    """return the query spec selecting all documents coming after the
+    position ``(value, _id)`` when sorting by ``sort_key`` and ``_id``
+    in the given ``direction``. Like MongoDB we sort documents with a null
+    or missing ``sort_key`` before all others."""
+    op = "$lt" if direction == pymongo.DESCENDING else "$gt"
+    if sort_key == "_id":
+        return {'_id' : {op : _id}}
+    same = {sort_key : value, '_id' : {op : _id}}
+
+    # null (or missing) values sort first and range operators never match
+    # them, so we need to handle them explicitly
+    if value is None:
+        if direction == pymongo.DESCENDING:
+            return same # only more nulls can follow
+        return {'$or' : [same, {sort_key : {'$ne' : None}}]}
+    after = [{sort_key : {op : value}}, same]
+    if direction == pymongo.DESCENDING:
+        after.append({sort_key : None})
+    return {'$or' : after}
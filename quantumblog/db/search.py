@@ -0,0 +1,224 @@
+import math
+import re
+
+import pymongo
+
+__all__ = ['SearchIndex', 'tokenize', 'stem']
+
+STOPWORDS = frozenset("""a an and are as at be but by for from has have i in
+is it its of on or that the this to was were will with you""".split())
+
+# suffixes stripped by ``stem()``, longest first
+SUFFIXES = [
+    (u"ational", u"ate"), (u"ization", u"ize"), (u"fulness", u"ful"),
+    (u"iveness", u"ive"), (u"ousness", u"ous"), (u"ement", u""),
+    (u"ingly", u""), (u"ments", u""), (u"ment", u""), (u"ness", u""),
+    (u"edly", u""), (u"ing", u""), (u"ies", u"y"), (u"ied", u"y"),
+    (u"ers", u""), (u"er", u""), (u"ly", u""), (u"es", u""), (u"ed", u""),
+    (u"s", u""),
+]
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def stem(word):
+    """return the stem of a lowercased word. This is a light suffix stripper
+    for english, good enough to match plurals and common inflections. We
+    always leave at least 3 characters."""
+    if word.endswith(u"ss"):
+        return word
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + replacement
+            break
+    # so that vote, votes and voted end up the same
+    if word.endswith(u"e") and len(word) > 3:
+        word = word[:-1]
+    return word
+
+def tokenize(text):
+    """split ``text`` into a list of stemmed terms without stopwords"""
+    if not text:
+        return []
+    if not isinstance(text, unicode):
+        text = unicode(text, "utf-8", "replace")
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        terms.append(stem(word))
+    return terms
+
+class SearchIndex(object):
+    """an inverted index for the ``searchable`` fields of the records in a
+    collection. The postings are stored in the ``<collection>.search``
+    collection, one document ``{'t' : term, 'd' : _id, 'w' : weight}`` per
+    term and record, where the weight is the term frequency multiplied
+    by the weight of the field. The number of records containing a term
+    is kept in ``<collection>.search_terms`` as ``{'_id' : term, 'df' : n}``
+    so we don't need to read all postings of a term to compute its idf.
+
+    The index is kept up to date by the listeners connected in
+    ``Collection.setup_listeners()``. Use ``rebuild()`` to index existing
+    records. The indexes it needs are created by ``ensure_indexes()``.
+    """
+
+    # the number of postings read per query term, see ``scores()``
+    max_postings = 1000
+
+    def __init__(self, coll):
+        """initialize the index for the ``Collection`` instance ``coll``"""
+        self.coll = coll
+        self.postings = coll.collection['search']
+        self.stats = coll.collection['search_terms']
+
+    def ensure_indexes(self):
+        """create the indexes on the postings"""
+        self.postings.ensure_index([('t', pymongo.ASCENDING), 
+                                    ('w', pymongo.DESCENDING)])
+        self.postings.ensure_index([('d', pymongo.ASCENDING)])
+
+    def terms(self, doc):
+        """return a dictionary mapping terms to weights for a record or a
+        document from mongodb"""
+        weights = {}
+        for name, weight in self.coll.data_cls.searchable.items():
+            for term in tokenize(doc.get(name, None)):
+                weights[term] = weights.get(term, 0) + weight
+        return weights
+
+    def postings_for(self, doc):
+        """return the postings to store for a document"""
+        return [{'t' : t, 'd' : doc['_id'], 'w' : w}
+                for t, w in self.terms(doc).items()]
+
+    def _inc_df(self, terms, amount):
+        """change the document frequency of ``terms`` by ``amount``. We
+        update the existing terms at once and only need an upsert for the
+        new ones."""
+        if amount > 0:
+            existing = set([s['_id'] for s in 
+                            self.stats.find({'_id' : {'$in' : terms}}, ['_id'])])
+        else:
+            existing = set(terms) # removed terms were indexed before
+        if existing:
+            self.stats.update({'_id' : {'$in' : list(existing)}}, 
+                              {'$inc' : {'df' : amount}}, multi = True)
+        for t in terms:
+            if t not in existing:
+                # the upsert also works if somebody added it in the meantime
+                self.stats.update({'_id' : t}, {'$inc' : {'df' : amount}}, 
+                                  upsert = True)
+
+    def index(self, doc):
+        """(re)index a record. Records not in a visible workflow state are
+        removed from the index. Only the postings of changed terms are
+        written. This takes several writes, so calls for the same record
+        must not run concurrently (``Events`` makes sure of that)."""
+        wf_spec = self.coll.workflow_spec()
+        if wf_spec and doc.get("workflow", None) not in \
+                self.coll.data_cls.visible_workflow_states:
+            self.unindex(doc['_id'])
+            return
+        old = dict([(p['t'], p['w']) for p in 
+                    self.postings.find({'d' : doc['_id']}, ['t', 'w'])])
+        new = self.terms(doc)
+        removed = [t for t in old if not new.has_key(t)]
+        if removed:
+            self.postings.remove({'d' : doc['_id'], 't' : {'$in' : removed}})
+            self._inc_df(removed, -1)
+        for t, w in new.items():
+            if old.has_key(t) and old[t] != w:
+                self.postings.update({'d' : doc['_id'], 't' : t}, 
+                                     {'$set' : {'w' : w}})
+        added = [{'t' : t, 'd' : doc['_id'], 'w' : w} 
+                 for t, w in new.items() if not old.has_key(t)]
+        if added:
+            self.postings.insert(added)
+            self._inc_df([p['t'] for p in added], 1)
+
+    def unindex(self, _id):
+        """remove a record from the index"""
+        terms = [p['t'] for p in self.postings.find({'d' : _id}, ['t'])]
+        if terms:
+            self.postings.remove({'d' : _id})
+            self._inc_df(terms, -1)
+
+    def rebuild(self, batch_size=1000):
+        """index all records from scratch in one streaming pass
+
+        :return: the number of records indexed
+        """
+        self.postings.remove({})
+        self.stats.remove({})
+        fields = self.coll.data_cls.searchable.keys()
+        spec = self.coll.workflow_spec()
+        df = {}
+        batch = []
+        n = 0
+        for doc in self.coll.collection.find(spec, fields).batch_size(batch_size):
+            for p in self.postings_for(doc):
+                df[p['t']] = df.get(p['t'], 0) + 1
+                batch.append(p)
+            n = n + 1
+            if len(batch) >= batch_size:
+                self.postings.insert(batch)
+                batch = []
+        if batch:
+            self.postings.insert(batch)
+        stats = [{'_id' : t, 'df' : c} for t, c in df.iteritems()]
+        for i in range(0, len(stats), batch_size):
+            self.stats.insert(stats[i:i+batch_size])
+        return n
+
+    def scores(self, query):
+        """return a dictionary mapping ids to the tf-idf score of the records
+        matching ``query``. 
+
+        For every term we only read the ``max_postings`` postings with the
+        highest weight, so a query for a common term doesn't scan a large
+        part of the index. This is an approximation: a record missing from
+        the list of a term loses that part of its score, but as these are
+        the records with the lowest weights it mostly affects records far
+        down the ranking."""
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return {}
+        df = dict([(s['_id'], s['df']) for s in 
+                   self.stats.find({'_id' : {'$in' : terms}})])
+        n = float(self.coll.collection.count()) or 1.0
+        scores = {}
+        for t in terms:
+            if df.get(t, 0) <= 0:
+                continue
+            idf = math.log(1.0 + n / df[t])
+            postings = self.postings.find({'t' : t}, ['d', 'w']) \
+                           .sort('w', pymongo.DESCENDING).limit(self.max_postings)
+            for p in postings:
+                scores[p['d']] = scores.get(p['d'], 0.0) + p['w'] * idf
+        return scores
+
+    def search(self, query, limit=20):
+        """return a list of the records matching ``query`` ordered by score"""
+        scores = self.scores(query)
+        ids = sorted(scores, key=lambda i: scores[i], reverse=True)[:limit]
+        if not ids:
+            return []
+        objs = dict([(o['_id'], o) for o in self.coll._find({'_id' : {'$in' : ids}})])
+        return [objs[i] for i in ids if objs.has_key(i)]
+
+class SearchListener(object):
+    """updates a ``SearchIndex`` on ``put:after`` and ``remove:after`` events.
+    It's connected asynchronously, so it gets the record as currently
+    stored instead of the object passed to ``put()`` and the events of a
+    record are handled one after another."""
+
+    def __init__(self, index):
+        self.index = index
+        self.listener_id = "search:%s" %index.coll.collection.name
+
+    def __call__(self, name, e, settings):
+        """update the index for the stored or removed object"""
+        if e.has_key('obj'):
+            self.index.index(e['obj'])
+        else:
+            self.index.unindex(e['_id'])
@@ -0,0 +1,311 @@
+"""an in-memory stand-in for the parts of the pymongo ``Collection`` API the
+data layer uses. It's meant for tests and for benchmarking the python side
+of ``quantumblog.db`` without the noise of a database server, not as a
+complete implementation of the MongoDB query language.
+
+Supported are the query operators ``$in``, ``$nin``, ``$ne``, ``$lt``,
+``$lte``, ``$gt``, ``$gte``, ``$exists``, ``$or`` and ``$and`` and the
+update operators ``$set``, ``$inc`` and ``$unset``. Anything else raises
+an ``UnsupportedOperator`` error instead of silently returning wrong
+results. Values are stored like MongoDB does it, so datetimes come back
+as naive UTC with millisecond precision.
+"""
+
+import copy
+import datetime
+
+from pymongo.objectid import ObjectId
+
+class UnsupportedOperator(ValueError):
+    """raised for query or update operators the stand-in doesn't implement"""
+
+    def __init__(self, op):
+        ValueError.__init__(self, "memorydb does not support the %s operator" %op)
+        self.op = op
+
+def _stored(value):
+    """return a copy of ``value`` as MongoDB would return it after storing
+    it. Datetimes lose their timezone (they are UTC then) and everything
+    below milliseconds."""
+    if isinstance(value, dict):
+        return dict([(k, _stored(v)) for k, v in value.items()])
+    if isinstance(value, (list, tuple)):
+        return [_stored(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond / 1000 * 1000)
+    return copy.deepcopy(value)
+
+def _get(doc, key):
+    """return the value of a possibly dotted ``key`` or ``None``"""
+    for part in key.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part, None)
+    return doc
+
+def _match_value(value, cond):
+    """check a single value against a condition"""
+    if isinstance(cond, dict) and cond and cond.keys()[0].startswith("$"):
+        for op, arg in cond.items():
+            if op == "$in":
+                if value not in arg:
+                    return False
+            elif op == "$nin":
+                if value in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op == "$lt":
+                if value is None or not value < arg:
+                    return False
+            elif op == "$lte":
+                if value is None or not value <= arg:
+                    return False
+            elif op == "$gt":
+                if value is None or not value > arg:
+                    return False
+            elif op == "$gte":
+                if value is None or not value >= arg:
+                    return False
+            elif op == "$exists":
+                if (value is not None) != arg:
+                    return False
+            else:
+                raise UnsupportedOperator(op)
+        return True
+    if isinstance(value, list) and not isinstance(cond, list):
+        return cond in value
+    return value == cond
+
+def match(doc, spec):
+    """check if ``doc`` matches the query ``spec``"""
+    for key, cond in spec.items():
+        if key == "$or":
+            if not [s for s in cond if match(doc, s)]:
+                return False
+        elif key == "$and":
+            if [s for s in cond if not match(doc, s)]:
+                return False
+        elif key.startswith("$"):
+            raise UnsupportedOperator(key)
+        elif not _match_value(_get(doc, key), cond):
+            return False
+    return True
+
+def _project(doc, fields):
+    if fields is None:
+        return copy.deepcopy(doc)
+    if isinstance(fields, dict):
+        fields = [k for k, v in fields.items() if v]
+    result = {'_id' : doc['_id']}
+    for f in fields:
+        if doc.has_key(f):
+            result[f] = copy.deepcopy(doc[f])
+    return result
+
+class Cursor(object):
+    """a cursor over the results of ``MemoryCollection.find()``"""
+
+    def __init__(self, docs, fields=None):
+        self.docs = docs
+        self.fields = fields
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, basestring):
+            key_or_list = [(key_or_list, direction)]
+        self._sort = list(key_or_list)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def count(self):
+        return len(self.docs)
+
+    def _results(self):
+        docs = self.docs
+        for key, direction in reversed(self._sort):
+            docs = sorted(docs, key=lambda d: _get(d, key),
+                          reverse=direction < 0)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return docs
+
+    def __iter__(self):
+        for doc in self._results():
+            yield _project(doc, self.fields)
+
+class MemoryCollection(object):
+    """a collection keeping its documents in a dictionary"""
+
+    def __init__(self, name, database=None):
+        self.name = name
+        self.database = database if database is not None else {}
+        self.docs = {}
+        self.indexes = []
+
+    def __getitem__(self, name):
+        full_name = "%s.%s" %(self.name, name)
+        if not self.database.has_key(full_name):
+            self.database[full_name] = MemoryCollection(full_name, self.database)
+        return self.database[full_name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def _find(self, spec):
+        if spec is None:
+            spec = {}
+        # look up the documents by ``_id`` first if we can, then check the rest
+        candidates = self.docs.values()
+        cond = spec.get('_id', None)
+        if cond is not None and not isinstance(cond, dict):
+            candidates = [self.docs[cond]] if self.docs.has_key(cond) else []
+        elif isinstance(cond, dict) and cond.keys() == ['$in']:
+            candidates = [self.docs[i] for i in cond['$in'] if self.docs.has_key(i)]
+        return [d for d in candidates if match(d, spec)]
+
+    def find(self, spec=None, fields=None, **kw):
+        return Cursor(self._find(spec), fields)
+
+    def find_one(self, spec=None, fields=None, **kw):
+        if spec is not None and not isinstance(spec, dict):
+            spec = {'_id' : spec}
+        for doc in self.find(spec, fields).limit(1):
+            return doc
+        return None
+
+    def count(self):
+        return len(self.docs)
+
+    def insert(self, doc_or_docs, *args, **kw):
+        docs = doc_or_docs
+        if isinstance(docs, dict):
+            docs = [docs]
+        for doc in docs:
+            if not doc.has_key('_id'):
+                doc['_id'] = ObjectId()
+            self.docs[doc['_id']] = _stored(doc)
+        if isinstance(doc_or_docs, dict):
+            return doc_or_docs['_id']
+        return [d['_id'] for d in docs]
+
+    def save(self, doc, *args, **kw):
+        if not doc.has_key('_id'):
+            doc['_id'] = ObjectId()
+        self.docs[doc['_id']] = _stored(doc)
+        return doc['_id']
+
+    def _apply(self, doc, document):
+        if not [k for k in document if k.startswith("$")]:
+            new = _stored(document)
+            new['_id'] = doc['_id']
+            return new
+        for op, values in document.items():
+            for key, value in values.items():
+                if op == "$set":
+                    doc[key] = _stored(value)
+                elif op == "$inc":
+                    doc[key] = doc.get(key, 0) + value
+                elif op == "$unset":
+                    doc.pop(key, None)
+                else:
+                    raise UnsupportedOperator(op)
+        return doc
+
+    def update(self, spec, document, upsert=False, manipulate=False,
+                     safe=False, multi=False, **kw):
+        docs = self._find(spec)
+        if not docs and upsert:
+            doc = dict([(k, v) for k, v in spec.items()
+                        if not k.startswith("$") and not isinstance(v, dict)])
+            doc.setdefault('_id', ObjectId())
+            docs = [doc]
+        if not multi:
+            docs = docs[:1]
+        for doc in docs:
+            doc = self._apply(doc, document)
+            self.docs[doc['_id']] = doc
+        if safe:
+            return {'ok' : 1.0, 'n' : len(docs), 'err' : None}
+
+    def find_and_modify(self, query={}, update=None, sort=None,
+                              new=False, **kw):
+        cursor = Cursor(self._find(query))
+        if sort:
+            cursor.sort(sort.items())
+        for doc in cursor.limit(1):
+            old = copy.deepcopy(doc)
+            self.update({'_id' : doc['_id']}, update)
+            return self.find_one(doc['_id']) if new else old
+        return None
+
+    def remove(self, spec_or_id=None, *args, **kw):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id' : spec_or_id}
+        for doc in self._find(spec_or_id):
+            del self.docs[doc['_id']]
+
+    def ensure_index(self, key_or_list, **kw):
+        self.indexes.append((key_or_list, kw))
+
+    create_index = ensure_index
+
+    def drop(self):
+        self.docs = {}
+
+    def rename(self, new_name, **kw):
+        target = self.database.setdefault(new_name,
+                                          MemoryCollection(new_name, self.database))
+        target.docs = self.docs
+        self.docs = {}
+
+class MemoryDatabase(object):
+    """a database of ``MemoryCollection`` instances"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if not self.collections.has_key(name):
+            self.collections[name] = MemoryCollection(name, self.collections)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+class MemoryStorage(object):
+    """a file storage keeping the files in memory"""
+
+    def __init__(self):
+        self.files = {}
+
+    def put(self, fp, **kw):
+        asset_id = unicode(ObjectId())
+        self.files[asset_id] = fp.getvalue()
+        return {'asset_id' : asset_id, 'created' : datetime.datetime.now()}
+
+    def delete(self, filedata):
+        self.files.pop(filedata.get('asset_id', None), None)
+
+    def url_for(self, filedata):
+        return "/assets/%s" %filedata['asset_id']
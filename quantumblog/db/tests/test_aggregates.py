@@ -0,0 +1,58 @@
+import pymongo
+import starflyer
+
+from quantumblog.db import Aggregate, Record, Collection, Field, Events
+from quantumblog.db.aggregates import aggregate_collection
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+def test_count():
+    agg = Aggregate("votes", "entry_id")
+    assert agg.contribution({'entry_id' : u"e1"}) == (u"e1", 1)
+    assert agg.contribution({'foo' : u"bar"}) is None
+    assert agg.contribution(None) is None
+
+def test_sum():
+    agg = Aggregate("points", "entry_id", "points")
+    assert agg.contribution({'entry_id' : u"e1", 'points' : 5}) == (u"e1", 5)
+    assert agg.contribution({'entry_id' : u"e1"}) == (u"e1", 0)
+
+def test_workflow():
+    agg = Aggregate("votes", "entry_id")
+    doc = {'entry_id' : u"e1", 'workflow' : u"active"}
+    assert agg.contribution(doc) == (u"e1", 1)
+    doc['workflow'] = u"deleted"
+    assert agg.contribution(doc) is None
+
+class Vote(Record):
+    fields = {
+        'entry_id' : Field(),
+    }
+
+class Votes(Collection):
+    data_cls = Vote
+    aggregates = [Aggregate("votes", "entry_id")]
+
+def make_votes():
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    return Votes(MemoryDatabase().votes, settings = settings)
+
+def test_ranking_index():
+    votes = make_votes()
+    results = aggregate_collection(votes, votes.aggregates[0])
+    for entry_id in (u"e1", u"e2", u"e2"):
+        votes.put(Vote({'entry_id' : entry_id}))
+    assert votes.ranking("votes") == [(u"e2", 2), (u"e1", 1)]
+    assert results.indexes == [] # reading must not create indexes
+    votes.ensure_indexes()
+    assert results.indexes == [([('value', pymongo.DESCENDING)], {})]
+
+def test_rebuild():
+    votes = make_votes()
+    for entry_id in (u"e1", u"e2", u"e2"):
+        votes.put(Vote({'entry_id' : entry_id}))
+    results = aggregate_collection(votes, votes.aggregates[0])
+    results.drop()
+    votes.rebuild_aggregates()
+    assert votes.aggregated("votes", u"e2") == 2
+    assert votes.ranking("votes") == [(u"e2", 2), (u"e1", 1)]
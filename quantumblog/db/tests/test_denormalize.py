@@ -0,0 +1,74 @@
+import starflyer
+
+from quantumblog.db import Record, Collection, Field, Denormalized, Events
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+class User(Record):
+    fields = {
+        'username' : Field(),
+    }
+
+class Entry(Record):
+    fields = {
+        'title' : Field(),
+        'user_id' : Field(),
+    }
+    denormalized = {
+        'author_name' : Denormalized('users', 'user_id', 'username'),
+    }
+
+class Users(Collection):
+    data_cls = User
+
+class Entries(Collection):
+    data_cls = Entry
+
+def make_settings():
+    db = MemoryDatabase()
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    settings.users = Users(db.users, settings = settings)
+    settings.entries = Entries(db.entries, settings = settings)
+    settings.entries.setup_listeners()
+    return settings
+
+def test_fill_on_put():
+    settings = make_settings()
+    user = settings.users.put(User({'username' : u"alice"}))
+    by_id = settings.entries.put(Entry({'title' : u"a", 'user_id' : user['_id']}))
+    by_str = settings.entries.put(Entry({'title' : u"b", 
+                                         'user_id' : unicode(user['_id'])}))
+    assert by_id['author_name'] == u"alice"
+    assert by_str['author_name'] == u"alice"
+    doc = settings.entries.collection.find_one({'_id' : by_str['_id']})
+    assert doc['author_name'] == u"alice"
+
+def test_fill_missing_reference():
+    settings = make_settings()
+    entry = settings.entries.put(Entry({'title' : u"a", 'user_id' : None}))
+    assert entry['author_name'] is None
+
+def test_listener_updates_dependents():
+    settings = make_settings()
+    user = settings.users.put(User({'username' : u"alice"}))
+    other = settings.users.put(User({'username' : u"bob"}))
+    settings.entries.put(Entry({'title' : u"a", 'user_id' : user['_id']}))
+    settings.entries.put(Entry({'title' : u"b", 'user_id' : unicode(user['_id'])}))
+    settings.entries.put(Entry({'title' : u"c", 'user_id' : other['_id']}))
+
+    user['username'] = u"alice2"
+    settings.users.put(user)
+    names = dict([(d['title'], d['author_name']) 
+                  for d in settings.entries.collection.find()])
+    assert names == {u"a" : u"alice2", u"b" : u"alice2", u"c" : u"bob"}
+
+def test_listener_skips_up_to_date():
+    settings = make_settings()
+    user = settings.users.put(User({'username' : u"alice"}))
+    entry = settings.entries.put(Entry({'title' : u"a", 'user_id' : user['_id']}))
+    updated = settings.entries.collection.find_one({'_id' : entry['_id']})['_updated']
+
+    # storing the user unchanged must not touch the entry
+    settings.users.put(user)
+    doc = settings.entries.collection.find_one({'_id' : entry['_id']})
+    assert doc['_updated'] == updated
@@ -0,0 +1,201 @@
+import datetime
+import threading
+import time
+
+import pytest
+import starflyer
+
+from quantumblog.db import Events, DurableQueue, Record, Collection, Field, \
+                           connect_listeners
+from quantumblog.db.dispatch import WorkerPool
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+def test_handle():
+    events = Events()
+    calls = []
+    def listener(name, e, settings):
+        calls.append((name, e['value'], settings))
+    events.connect("db.examples.put:after", listener)
+    events.handle("db.examples.put:after", {'value' : 1}, "settings")
+    events.handle("db.other.put:after", {'value' : 2}, "settings")
+    assert calls == [("db.examples.put:after", 1, "settings")]
+
+def test_disconnect():
+    events = Events()
+    calls = []
+    listener = lambda name, e, settings: calls.append(name)
+    events.connect("foo", listener)
+    events.disconnect("foo", listener)
+    events.disconnect("bar", listener)
+    events.handle("foo")
+    assert calls == []
+
+def test_asynchronous():
+    events = Events()
+    calls = []
+    def listener(name, e, settings):
+        calls.append(e['value'])
+    events.connect("foo:after", listener, asynchronous=True)
+    events.handle("foo:after", {'value' : 1})
+    events.pool.join()
+    assert calls == [1]
+
+def test_before_is_synchronous():
+    events = Events()
+    listener = lambda name, e, settings: None
+    pytest.raises(ValueError, events.connect, "foo:before", listener, 
+                  asynchronous=True)
+
+def test_durable_needs_queue():
+    events = Events()
+    listener = lambda name, e, settings: None
+    pytest.raises(ValueError, events.connect, "foo:after", listener, 
+                  durable=True)
+
+def test_stats():
+    events = Events()
+    def listener(name, e, settings):
+        if e.get('fail'):
+            raise ValueError()
+    events.connect("foo", listener)
+    events.handle("foo", {})
+    pytest.raises(ValueError, events.handle, "foo", {'fail' : True})
+    stats = events.stats()
+    assert len(stats) == 1
+    assert stats[0]['event'] == "foo"
+    assert stats[0]['listener'].endswith(".listener")
+    assert stats[0]['calls'] == 2
+    assert stats[0]['errors'] == 1
+
+def test_pool_keeps_order_per_key():
+    pool = WorkerPool(4, 100)
+    calls = []
+    def work(key, i):
+        time.sleep(0.001 * (i % 3))
+        calls.append((key, i))
+    for i in range(30):
+        pool.submit(i % 2, work, i % 2, i)
+    pool.join()
+    for key in (0, 1):
+        assert [i for k, i in calls if k == key] == range(key, 30, 2)
+
+class Example(Record):
+    fields = {
+        'title' : Field(),
+        'workflow' : Field(),
+    }
+    searchable = {'title' : 1}
+
+class Examples(Collection):
+    data_cls = Example
+    use_objectids = False
+
+def make_examples():
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    settings.examples = Examples(MemoryDatabase().examples, settings = settings)
+    connect_listeners(settings)
+    return settings
+
+def test_asynchronous_reloads():
+    settings = make_examples()
+    seen = []
+    def listener(name, e, settings):
+        seen.append(e['obj']['title'])
+    settings.events.connect("db.examples.put:after", listener, asynchronous=True)
+    obj = settings.examples.put(Example({'_id' : u"a", 'title' : u"stored"}))
+    obj['title'] = u"changed later" # must not leak into the listener
+    settings.events.pool.join()
+    assert seen == [u"stored"]
+
+def test_concurrent_puts_of_one_record():
+    settings = make_examples()
+    index = settings.examples.search_index
+    start = threading.Event()
+    def put(title):
+        start.wait()
+        settings.examples.put(Example({'_id' : u"a", 'title' : title, 
+                                       'workflow' : u"active"}))
+    for i in range(20):
+        threads = [threading.Thread(target=put, args=(title,))
+                   for title in (u"guitar remix", u"drums solo")]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        start.clear()
+        settings.events.pool.join()
+
+        doc = settings.examples.collection.find_one({'_id' : u"a"})
+        postings = sorted([p['t'] for p in index.postings.find({'d' : u"a"})])
+        assert postings == sorted(index.terms(doc).keys())
+        df = dict([(s['_id'], s['df']) for s in index.stats.find() if s['df']])
+        assert df == dict([(t, 1) for t in postings])
+
+def make_queue(listener, max_attempts=3):
+    """return settings with a durable ``listener`` for examples"""
+    settings = make_examples()
+    queue = DurableQueue(MemoryDatabase().event_queue, max_attempts)
+    settings.events.queue = queue
+    settings.events.connect("db.examples.put:after", listener, durable=True)
+    return settings, queue
+
+def test_durable():
+    calls = []
+    def listener(name, e, settings):
+        calls.append((name, e['obj']['title']))
+    settings, queue = make_queue(listener)
+    obj = settings.examples.put(Example({'_id' : u"a", 'title' : u"first"}))
+    assert calls == [] # nothing happens before the queue is processed
+    job = queue.collection.find_one()
+    assert job['state'] == u"pending" and job['ref'] == u"a"
+
+    obj['title'] = u"second"
+    settings.examples.collection.save(obj.to_mongo())
+    assert queue.process(settings.events, settings) == 1
+    assert calls == [("db.examples.put:after", u"second")] # read again
+    assert queue.collection.find_one() is None
+    assert queue.process(settings.events, settings) == 0
+
+def test_durable_removed():
+    calls = []
+    def listener(name, e, settings):
+        calls.append(e.get('_id'))
+    settings, queue = make_queue(listener)
+    settings.examples.put(Example({'_id' : u"a", 'title' : u"first"}))
+    settings.examples.collection.remove({'_id' : u"a"})
+    queue.process(settings.events, settings)
+    assert calls == [u"a"]
+
+def test_durable_retry():
+    def listener(name, e, settings):
+        raise ValueError("broken")
+    settings, queue = make_queue(listener, max_attempts=2)
+    settings.examples.put(Example({'_id' : u"a", 'title' : u"first"}))
+    assert queue.process(settings.events, settings) == 1
+    job = queue.collection.find_one()
+    assert job['state'] == u"pending"
+    assert job['attempts'] == 1
+    assert "broken" in job['error']
+    assert job['run_at'] > datetime.datetime.utcnow() # backing off
+    assert queue.process(settings.events, settings) == 0
+
+    queue.collection.update({'_id' : job['_id']}, 
+                            {'$set' : {'run_at' : datetime.datetime.utcnow()}})
+    assert queue.process(settings.events, settings) == 1
+    job = queue.collection.find_one()
+    assert job['state'] == u"failed"
+    assert job['attempts'] == 2
+
+def test_requeue_stale():
+    settings, queue = make_queue(lambda name, e, settings: None, max_attempts=2)
+    started = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    for attempts in (1, 2):
+        queue.collection.insert({'_id' : attempts, 'state' : u"running",
+                                 'attempts' : attempts, 'started' : started})
+    queue.collection.insert({'_id' : 3, 'state' : u"running", 'attempts' : 1,
+                             'started' : datetime.datetime.utcnow()})
+    queue.requeue_stale()
+    states = dict([(j['_id'], j['state']) for j in queue.collection.find()])
+    assert states == {1 : u"pending", 2 : u"failed", 3 : u"running"}
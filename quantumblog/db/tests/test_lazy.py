@@ -0,0 +1,38 @@
+import compileall
+import os
+
+import quantumblog.db
+
+LazyModule = type(quantumblog.db)
+
+def write(path, data):
+    f = open(path, "w")
+    f.write(data)
+    f.close()
+
+def make_package(tmpdir, monkeypatch, name):
+    """create a package with the modules ``a`` and ``b`` both exporting
+    ``value`` and the module ``c`` which is only available compiled"""
+    path = tmpdir.mkdir(name)
+    write(str(path.join("__init__.py")), "")
+    write(str(path.join("a.py")), "__all__ = ['value', 'a']\nvalue = 'a'\na = 1\n")
+    write(str(path.join("b.py")), "value = 'b'\n")
+    write(str(path.join("c.py")), "__all__ = ['c']\nc = 3\n")
+    compileall.compile_dir(str(path), quiet=True)
+    os.remove(str(path.join("c.py")))
+    monkeypatch.syspath_prepend(str(tmpdir))
+    __import__(name)
+    module = LazyModule(name)
+    module.__path__ = [str(path)]
+    module.MODULES = ['a', 'b', 'c', 'missing']
+    return module
+
+def test_last_module_wins(tmpdir, monkeypatch):
+    module = make_package(tmpdir, monkeypatch, "lazy_last")
+    assert module.value == 'b'
+    assert module.a == 1
+
+def test_compiled_only(tmpdir, monkeypatch):
+    module = make_package(tmpdir, monkeypatch, "lazy_compiled")
+    assert module.c == 3
+    assert module.__all__ == ['value', 'a', 'c']
@@ -0,0 +1,26 @@
+from quantumblog.db.tests.memorydb import MemoryDatabase, UnsupportedOperator
+
+import pytest
+
+def make_coll():
+    coll = MemoryDatabase().examples
+    for i in range(5):
+        coll.insert({'_id' : i, 'workflow' : u"deleted" if i == 3 else u"active"})
+    return coll
+
+def test_id_with_more_conditions():
+    coll = make_coll()
+    assert coll.find_one({'_id' : 2, 'workflow' : u"active"})['_id'] == 2
+    assert coll.find_one({'_id' : 3, 'workflow' : u"active"}) is None
+    assert coll.find_one({'_id' : 9, 'workflow' : u"active"}) is None
+
+def test_id_in():
+    coll = make_coll()
+    docs = coll.find({'_id' : {'$in' : [1, 3, 9]}, 'workflow' : u"active"})
+    assert [d['_id'] for d in docs] == [1]
+
+def test_unsupported_operator():
+    coll = make_coll()
+    pytest.raises(UnsupportedOperator, coll.find_one, {'_id' : {'$regex' : "x"}})
+    pytest.raises(UnsupportedOperator, coll.find_one, {'$where' : "x"})
+    pytest.raises(UnsupportedOperator, coll.update, {'_id' : 1}, {'$push' : {'a' : 1}})
@@ -0,0 +1,107 @@
+from quantumblog.db import Page, encode_token, decode_token, keyset_spec
+from quantumblog.db import Record, Collection, Field, View, DataError
+from quantumblog.db.tests.memorydb import MemoryDatabase
+from pymongo.objectid import ObjectId
+import datetime
+import pymongo
+
+import pytest
+
+class Example(Record):
+    fields = {
+        'n' : Field(),
+    }
+
+class Examples(Collection):
+    data_cls = Example
+    use_objectids = False
+
+def test_token_roundtrip():
+    _id = ObjectId()
+    date = datetime.datetime(2010, 5, 17, 12, 30, 15, 12345)
+    token = encode_token(date, _id)
+    assert "=" not in token
+    assert decode_token(token) == (date, _id)
+
+def test_token_plain_values():
+    assert decode_token(encode_token(u"foo", u"abc")) == (u"foo", u"abc")
+
+def test_invalid_token():
+    pytest.raises(ValueError, decode_token, "not a token")
+    forged = encode_token({'$oid' : "not an id"}, 1)
+    pytest.raises(ValueError, decode_token, forged)
+    forged = encode_token({'$date' : "yesterday"}, 1)
+    pytest.raises(ValueError, decode_token, forged)
+
+def test_paginate_invalid_token():
+    coll = make_examples()
+    forged = encode_token(1, {'$oid' : "not an id"})
+    pytest.raises(DataError, coll.paginate, sort_key = "n", token = forged)
+
+def test_keyset_spec():
+    _id = ObjectId()
+    spec = keyset_spec("date", 5, _id, pymongo.ASCENDING)
+    assert spec == {'$or' : [
+        {'date' : {'$gt' : 5}},
+        {'date' : 5, '_id' : {'$gt' : _id}},
+    ]}
+    assert keyset_spec("_id", _id, _id) == {'_id' : {'$lt' : _id}}
+
+def test_keyset_spec_null():
+    _id = ObjectId()
+    spec = keyset_spec("date", None, _id, pymongo.ASCENDING)
+    assert spec == {'$or' : [
+        {'date' : None, '_id' : {'$gt' : _id}},
+        {'date' : {'$ne' : None}},
+    ]}
+    spec = keyset_spec("date", None, _id, pymongo.DESCENDING)
+    assert spec == {'date' : None, '_id' : {'$lt' : _id}}
+    spec = keyset_spec("date", 5, _id, pymongo.DESCENDING)
+    assert {'date' : None} in spec['$or']
+
+def make_examples():
+    coll = Examples(MemoryDatabase().examples, settings = {})
+    for i, n in enumerate([3, None, 1, None, 2, 5, None, 4]):
+        doc = {'_id' : i}
+        if n is not None or i == 1: # one explicit null, two missing
+            doc['n'] = n
+        coll.collection.insert(doc)
+    return coll
+
+def walk(coll, direction):
+    """page through all examples two at a time"""
+    seen = []
+    page = coll.paginate(sort_key = "n", direction = direction, limit = 2)
+    seen.extend([o.get('n') for o in page])
+    while page.has_more:
+        page = coll.paginate(sort_key = "n", direction = direction, limit = 2,
+                             token = page.next_token)
+        seen.extend([o.get('n') for o in page])
+    return seen
+
+def test_paginate_with_nulls():
+    coll = make_examples()
+    assert walk(coll, pymongo.ASCENDING) == [None, None, None, 1, 2, 3, 4, 5]
+    assert walk(coll, pymongo.DESCENDING) == [5, 4, 3, 2, 1, None, None, None]
+
+def test_page():
+    page = Page([1,2,3], "abc")
+    assert page.has_more
+    assert not Page([1]).has_more
+
+def test_view_page():
+    db = MemoryDatabase()
+    coll = make_examples()
+    labels = Examples(db.labels, settings = {})
+    for n in range(1, 6):
+        labels.collection.insert({'_id' : n * 10, 'n' : n})
+    view = View('example', label = ('n', labels, 'n'))
+    page = view.page(coll, sort_key = "n", direction = pymongo.DESCENDING, 
+                     limit = 3)
+    assert [(d['example']['n'], d['label']['_id']) for d in page] == \
+        [(5, 50), (4, 40), (3, 30)]
+    page = view.page(coll, sort_key = "n", direction = pymongo.DESCENDING, 
+                     limit = 3, token = page.next_token)
+    assert [d['example']['n'] for d in page] == [2, 1, None]
+    assert page[2]['label'] is None
+    assert page.has_more
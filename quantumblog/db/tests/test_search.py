@@ -0,0 +1,119 @@
+from quantumblog.db import tokenize, stem, Record, Collection, Field
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+def test_stem():
+    assert stem(u"remixes") == u"remix"
+    assert stem(u"votes") == stem(u"vote") == stem(u"voted")
+    assert stem(u"entries") == u"entry"
+    assert stem(u"mixing") == u"mix"
+    assert stem(u"bass") == u"bass"
+    assert stem(u"is") == u"is"
+
+def test_tokenize():
+    assert tokenize(u"The Remixes of the Contest!") == [u"remix", u"contest"]
+    assert tokenize("caf\xc3\xa9 songs") == [u"caf\xe9", u"song"]
+    assert tokenize(None) == []
+
+class Example(Record):
+    fields = {
+        'title' : Field(),
+        'workflow' : Field(),
+    }
+    searchable = {'title' : 1}
+
+class Examples(Collection):
+    data_cls = Example
+    use_objectids = False
+
+def make_examples(*titles):
+    coll = Examples(MemoryDatabase().examples)
+    for i, title in enumerate(titles):
+        coll.put(Example({'_id' : i, 'title' : title, 'workflow' : u"active"}))
+    return coll
+
+def df(coll):
+    return dict([(s['_id'], s['df']) for s in coll.search_index.stats.find()
+                 if s['df']])
+
+def test_index():
+    coll = make_examples(u"guitar remix", u"drums")
+    index = coll.search_index
+    index.rebuild()
+    assert df(coll) == {u"guitar" : 1, u"remix" : 1, u"drum" : 1}
+
+    obj = coll.get(0)
+    obj['title'] = u"drums remix remix"
+    index.index(coll.put(obj))
+    assert df(coll) == {u"remix" : 1, u"drum" : 2}
+    assert index.postings.find_one({'d' : 0, 't' : u"remix"})['w'] == 2
+
+    index.unindex(1)
+    assert df(coll) == {u"remix" : 1, u"drum" : 1}
+
+def test_index_deleted():
+    coll = make_examples(u"guitar remix")
+    index = coll.search_index
+    index.rebuild()
+    obj = coll.get(0)
+    obj['workflow'] = u"deleted"
+    index.index(coll.put(obj))
+    assert df(coll) == {}
+    assert index.postings.find_one({'d' : 0}) is None
+
+def test_search():
+    coll = make_examples(u"guitar remix", u"remix remix", u"drums")
+    coll.search_index.rebuild()
+    assert [o['_id'] for o in coll.search(u"remixes")] == [1, 0]
+    assert [o['_id'] for o in coll.search(u"guitar remix")] == [0, 1]
+    assert coll.search(u"piano") == []
+    assert coll.search(u"the") == []
+
+def test_max_postings():
+    coll = make_examples(u"remix", u"remix remix", u"remix remix remix")
+    index = coll.search_index
+    index.rebuild()
+    index.max_postings = 2
+    assert sorted(index.scores(u"remix").keys()) == [1, 2]
+
+def test_remove_without_events():
+    coll = make_examples(u"guitar")
+    coll.remove(0)
+    assert coll.collection.find_one({'_id' : 0}) is None
+
+def test_indexes():
+    coll = make_examples(u"guitar remix")
+    coll.search(u"guitar")
+    assert coll.search_index.postings.indexes == [] # reading must not create them
+    coll.ensure_indexes()
+    assert len(coll.search_index.postings.indexes) == 2
+
+def test_batched_df_updates():
+    coll = make_examples(u"guitar remix")
+    index = coll.search_index
+    index.rebuild()
+    updates = []
+    update = index.stats.update
+    def counting_update(spec, document, *args, **kw):
+        updates.append(spec)
+        return update(spec, document, *args, **kw)
+    index.stats.update = counting_update
+
+    obj = coll.get(0)
+    obj['title'] = u"guitar remix drums bass synth"
+    index.index(coll.put(obj))
+    # one upsert per new term only
+    assert len(updates) == 3
+    assert df(coll) == {u"guitar" : 1, u"remix" : 1, u"drum" : 1, 
+                        u"bass" : 1, u"synth" : 1}
+
+    del updates[:]
+    obj = coll.put(Example({'_id' : 1, 'title' : u"guitar remix drums", 
+                            'workflow' : u"active"}))
+    index.index(obj)
+    assert len(updates) == 1
+    assert df(coll)[u"drum"] == 2
+
+    del updates[:]
+    index.unindex(0)
+    assert len(updates) == 1
+    assert df(coll) == {u"guitar" : 1, u"remix" : 1, u"drum" : 1}
@@ -0,0 +1,159 @@
+import datetime
+
+import pytest
+import starflyer
+
+from quantumblog.db import Record, Collection, Field, Denormalized, Events, \
+                           export_collection, import_collection, FORMATS
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+class User(Record):
+    fields = {
+        'username' : Field(),
+    }
+
+class Entry(Record):
+    fields = {
+        'title' : Field(),
+        'user_id' : Field(),
+    }
+    denormalized = {
+        'author_name' : Denormalized('users', 'user_id', 'username'),
+    }
+
+class Users(Collection):
+    data_cls = User
+    use_objectids = False
+
+class Entries(Collection):
+    data_cls = Entry
+    use_objectids = False
+
+class Interrupted(Exception):
+    pass
+
+class FailingFormat(object):
+    """wraps a format and fails after writing ``n`` documents"""
+
+    def __init__(self, fmt, n):
+        self.fmt = fmt
+        self.suffix = fmt.suffix
+        self.n = n
+
+    def write(self, fp, doc):
+        if self.n == 0:
+            raise Interrupted()
+        self.n = self.n - 1
+        self.fmt.write(fp, doc)
+
+def make_settings(n=5):
+    db = MemoryDatabase()
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    settings.users = Users(db.users, settings = settings)
+    settings.entries = Entries(db.entries, settings = settings)
+    settings.users.put(User({'_id' : u"u1", 'username' : u"alice"}))
+    for i in range(n):
+        settings.entries.put(Entry({'_id' : u"e%s" %i, 'title' : u"entry %s" %i,
+                                    'user_id' : u"u1"}))
+    return settings
+
+def docs(coll):
+    return list(coll.collection.find().sort("_id", 1))
+
+def round_trip(tmpdir, format):
+    settings = make_settings()
+    path = str(tmpdir.join("entries" + FORMATS[format].suffix))
+    assert export_collection(settings.entries, path, format, chunk_size=2) == 5
+    target = make_settings(0).entries
+    assert import_collection(target, path, format, chunk_size=2) == 5
+    return docs(settings.entries), docs(target)
+
+def test_jsonl(tmpdir):
+    exported, imported = round_trip(tmpdir, "jsonl")
+    assert exported == imported
+    assert isinstance(imported[0]['_updated'], datetime.datetime)
+
+def test_bson(tmpdir):
+    exported, imported = round_trip(tmpdir, "bson")
+    assert exported == imported
+
+def test_import_replaces(tmpdir):
+    settings = make_settings()
+    path = str(tmpdir.join("entries.jsonl"))
+    export_collection(settings.entries, path)
+    settings.entries.collection.update({'_id' : u"e1"}, 
+                                       {'$set' : {'title' : u"changed"}})
+    import_collection(settings.entries, path)
+    assert len(docs(settings.entries)) == 5
+    assert settings.entries.collection.find_one({'_id' : u"e1"})['title'] == \
+        u"entry 1"
+
+def test_export_resume(tmpdir, monkeypatch):
+    settings = make_settings()
+    path = str(tmpdir.join("entries.jsonl"))
+    monkeypatch.setitem(FORMATS, "jsonl", FailingFormat(FORMATS['jsonl'], 3))
+    pytest.raises(Interrupted, export_collection, settings.entries, path, 
+                  chunk_size=2)
+    monkeypatch.undo()
+    assert tmpdir.join("entries.jsonl.state").check()
+
+    # the third document of the incomplete chunk is dropped and written again
+    assert export_collection(settings.entries, path, chunk_size=2, 
+                             resume=True) == 5
+    assert not tmpdir.join("entries.jsonl.state").check()
+    lines = open(path).readlines()
+    assert len(lines) == 5
+    target = make_settings(0).entries
+    import_collection(target, path)
+    assert docs(target) == docs(settings.entries)
+
+def test_import_resume(tmpdir, monkeypatch):
+    settings = make_settings()
+    path = str(tmpdir.join("entries.jsonl"))
+    export_collection(settings.entries, path)
+    target = make_settings(0).entries
+
+    inserted = []
+    insert = target.collection.insert
+    def failing_insert(batch, *args, **kw):
+        if inserted:
+            raise Interrupted()
+        inserted.append(batch)
+        return insert(batch, *args, **kw)
+    monkeypatch.setattr(target.collection, "insert", failing_insert)
+    pytest.raises(Interrupted, import_collection, target, path, chunk_size=2)
+    monkeypatch.undo()
+    assert len(docs(target)) == 2
+
+    assert import_collection(target, path, chunk_size=2, resume=True) == 5
+    assert docs(target) == docs(settings.entries)
+    assert not tmpdir.join("entries.jsonl.import.state").check()
+
+def test_process(tmpdir):
+    settings = make_settings()
+    settings.entries.collection.update({'_id' : u"e1"}, 
+                                       {'$set' : {'obsolete' : 1}})
+    path = str(tmpdir.join("entries.jsonl"))
+    export_collection(settings.entries, path, process=True)
+    target = make_settings(0).entries
+    import_collection(target, path, process=True)
+    doc = target.collection.find_one({'_id' : u"e1"})
+    old = settings.entries.collection.find_one({'_id' : u"e1"})
+    assert not doc.has_key("obsolete") # only the fields of the record remain
+    assert doc['author_name'] == u"alice"
+    assert doc['_updated'] == old['_updated']
+    assert doc['title'] == u"entry 1"
+
+def test_refresh_denormalized(tmpdir):
+    settings = make_settings()
+    path = str(tmpdir.join("users.jsonl"))
+    settings.users.collection.update({'_id' : u"u1"}, 
+                                     {'$set' : {'username' : u"bob"}})
+    export_collection(settings.users, path)
+    target = make_settings()
+    import_collection(target.users, path)
+    assert target.entries.get(u"e1")['author_name'] == u"alice"
+    assert target.entries.refresh_denormalized() == 5
+    assert target.entries.get(u"e1")['author_name'] == u"bob"
+    assert target.entries.refresh_denormalized() == 0
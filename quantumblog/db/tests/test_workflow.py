@@ -0,0 +1,120 @@
+import datetime
+
+import pymongo
+
+from quantumblog.db import Record, Collection, Field
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+class Example(Record):
+    fields = {
+        'title' : Field(),
+        'workflow' : Field(),
+    }
+
+class Examples(Collection):
+    data_cls = Example
+    use_objectids = False
+    indexes = [[('title', pymongo.ASCENDING)]]
+
+class Plain(Record):
+    fields = {
+        'title' : Field(),
+    }
+
+class Plains(Collection):
+    data_cls = Plain
+    use_objectids = False
+    indexes = [[('title', pymongo.ASCENDING)]]
+
+def make_examples():
+    """return a collection with the active records 1 and 3 and the deleted
+    record 2. The titles are the numbers, the ids are generated."""
+    coll = Examples(MemoryDatabase().examples)
+    coll.ids = {}
+    for i in (1, 2, 3):
+        coll.ids[i] = coll.put(Example({'title' : i}))['_id']
+    obj = coll.get(coll.ids[2])
+    obj.set_workflow(u"deleted")
+    coll.put(obj)
+    return coll
+
+def ids(objs):
+    return sorted([o['title'] for o in objs])
+
+def test_new_records_are_active():
+    coll = make_examples()
+    assert coll.get(coll.ids[1])['workflow'] == u"active"
+
+def test_get():
+    coll = make_examples()
+    assert coll.get(coll.ids[2]) is None
+    assert coll.get(coll.ids[2], all_states=True)['workflow'] == u"deleted"
+    assert coll.get(u"unknown", all_states=True) is None
+
+def test_all():
+    coll = make_examples()
+    assert ids(coll.all) == [1, 3]
+    assert ids(coll.all_states) == [1, 2, 3]
+
+def test_query():
+    coll = make_examples()
+    assert ids(coll.query()) == [1, 3]
+    assert ids(coll.query_all_states()) == [1, 2, 3]
+
+def test_explicit_workflow():
+    coll = make_examples()
+    assert ids(coll._find({'workflow' : u"deleted"})) == [2]
+
+def test_paginate_and_stamps():
+    coll = make_examples()
+    assert ids(coll.paginate()) == [1, 3]
+    assert ids(coll.paginate(all_states=True)) == [1, 2, 3]
+    visible = sorted([coll.ids[1], coll.ids[3]])
+    assert sorted([s['_id'] for s in coll.stamps()]) == visible
+    assert len(coll.stamps(all_states=True)) == 3
+
+def test_no_filter():
+    coll = make_examples()
+    coll.filter_workflow = False
+    assert coll.workflow_spec() == {}
+    assert coll.get(coll.ids[2])['workflow'] == u"deleted"
+    assert Plains(MemoryDatabase().plains).workflow_spec() == {}
+
+def test_several_visible_states():
+    coll = make_examples()
+    coll.data_cls = type("Visible", (Example,), 
+        {'visible_workflow_states' : [u"active", u"deleted"]})
+    assert coll.workflow_spec() == \
+        {'workflow' : {'$in' : [u"active", u"deleted"]}}
+    assert ids(coll.all) == [1, 2, 3]
+
+def test_ensure_indexes():
+    coll = make_examples()
+    coll.ensure_indexes()
+    assert coll.collection.indexes == [([('title', pymongo.ASCENDING)],
+        {'partialFilterExpression' : {'workflow' : u"active"}})]
+
+    plains = Plains(MemoryDatabase().plains)
+    plains.ensure_indexes()
+    assert plains.collection.indexes == [([('title', pymongo.ASCENDING)], {})]
+
+def test_archive_deleted():
+    coll = make_examples()
+    obj = coll.put(Example({'title' : 4}))
+    obj.set_workflow(u"deleted")
+    coll.put(obj)
+    old = datetime.datetime.now() - datetime.timedelta(days=31)
+    coll.collection.update({'_id' : {'$in' : [coll.ids[2], coll.ids[3]]}}, 
+                           {'$set' : {'_updated' : old}}, multi=True)
+
+    # only 2 is deleted and old enough
+    assert coll.archive_deleted(batch_size=1) == 1
+    assert ids(coll.all_states) == [1, 3, 4]
+    archived = coll.collection['archive'].find_one({'_id' : coll.ids[2]})
+    assert archived['workflow'] == u"deleted"
+    assert coll.archive_deleted() == 0
+
+def test_archive_without_workflow():
+    plains = Plains(MemoryDatabase().plains)
+    plains.put(Plain({'title' : u"plain"}))
+    assert plains.archive_deleted(datetime.timedelta(0)) == 0
@@ -0,0 +1,220 @@
+import json
+import os
+import Queue
+import struct
+import threading
+
+try:
+    from bson import json_util
+    from bson import BSON
+    encode_bson = BSON.encode
+    decode_bson = lambda data: BSON(data).decode()
+except ImportError:
+    from pymongo import json_util
+    from pymongo.bson import BSON
+    encode_bson = BSON.from_dict
+    decode_bson = lambda data: BSON(data).to_dict()
+
+__all__ = ['export_collection', 'import_collection', 'run_parallel',
+           'FORMATS']
+
+class JSONLines(object):
+    """one JSON document per line using the MongoDB extended JSON syntax
+    for ObjectIds, dates etc."""
+
+    suffix = ".jsonl"
+
+    def write(self, fp, doc):
+        fp.write(json.dumps(doc, default=json_util.default) + "\n")
+
+    def read(self, fp):
+        """yield the documents in ``fp``. We use ``readline()`` instead of
+        iterating so that ``fp.tell()`` stays correct."""
+        while True:
+            line = fp.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line, object_hook=json_util.object_hook)
+
+class BSONFile(object):
+    """the BSON documents written one after another like ``mongodump`` does"""
+
+    suffix = ".bson"
+
+    def write(self, fp, doc):
+        fp.write(encode_bson(doc))
+
+    def read(self, fp):
+        while True:
+            size = fp.read(4)
+            if len(size) < 4:
+                break
+            length = struct.unpack("<i", size)[0]
+            yield decode_bson(size + fp.read(length - 4))
+
+FORMATS = {
+    'jsonl' : JSONLines(),
+    'bson' : BSONFile(),
+}
+
+def _process(coll, doc):
+    """pass a document through ``from_mongo()`` and ``to_mongo()`` of the
+    data class of ``coll``. The timestamps and denormalized values are
+    kept as they are."""
+    obj = coll.data_cls.from_mongo(doc, coll)
+    obj.set_collection(coll)
+    values = obj.to_mongo()
+    for name in coll.data_cls.denormalized:
+        values[name] = doc.get(name, None)
+    values['_updated'] = doc.get('_updated', None)
+    return values
+
+def _read_state(path):
+    """return the resume state stored for ``path`` or ``None``"""
+    if not os.path.exists(path + ".state"):
+        return None
+    f = open(path + ".state")
+    try:
+        return json.load(f, object_hook=json_util.object_hook)
+    finally:
+        f.close()
+
+def _write_state(path, state):
+    """store the resume state for ``path``. We write a temporary file first
+    so an interruption never leaves a broken state behind."""
+    f = open(path + ".state.tmp", "w")
+    try:
+        json.dump(state, f, default=json_util.default)
+    finally:
+        f.close()
+    os.rename(path + ".state.tmp", path + ".state")
+
+def _clear_state(path):
+    if os.path.exists(path + ".state"):
+        os.remove(path + ".state")
+
+def export_collection(coll, path, format="jsonl", process=False,
+                      chunk_size=1000, resume=False):
+    """write all documents of ``coll`` to the file ``path`` in ``_id`` order.
+
+    :param coll: the ``Collection`` to export
+    :param path: the file to write to
+    :param format: the name of the format to use, ``jsonl`` or ``bson``
+    :param process: pass the documents through the field pipelines instead
+        of copying them as they are stored
+    :param chunk_size: the number of documents to fetch at once. After each
+        chunk the position is stored so the export can be resumed.
+    :param resume: continue an interrupted export
+    :return: the number of documents exported
+    """
+    fmt = FORMATS[format]
+    state = _read_state(path) if resume else None
+    spec = {}
+    if state is not None:
+        spec = {'_id' : {'$gt' : state['last_id']}}
+        fp = open(path, "r+b")
+        fp.truncate(state['offset']) # drop the incomplete chunk
+        fp.seek(state['offset'])
+        n = state['count']
+    else:
+        fp = open(path, "wb")
+        n = 0
+    try:
+        cursor = coll.collection.find(spec).sort("_id", 1).batch_size(chunk_size)
+        last_id = None
+        for doc in cursor:
+            if process:
+                doc = _process(coll, doc)
+            fmt.write(fp, doc)
+            last_id = doc['_id']
+            n = n + 1
+            if n % chunk_size == 0:
+                fp.flush()
+                _write_state(path, {'last_id' : last_id, 'offset' : fp.tell(),
+                                    'count' : n})
+    finally:
+        fp.close()
+    _clear_state(path)
+    return n
+
+def import_collection(coll, path, format="jsonl", process=False,
+                      chunk_size=1000, resume=False):
+    """read the documents in ``path`` into ``coll`` using bulk inserts.
+    Documents already existing are replaced. No events are triggered for
+    the single documents, so rebuild aggregates and search indexes
+    afterwards. Only ``update:after`` is triggered once at the end so
+    caches depending on the collection are invalidated.
+
+    :param coll: the ``Collection`` to import into
+    :param path: the file to read
+    :param format: the name of the format to use, ``jsonl`` or ``bson``
+    :param process: pass the documents through the field pipelines instead
+        of storing them as they are
+    :param chunk_size: the number of documents to write at once. After each
+        chunk the position is stored so the import can be resumed.
+    :param resume: continue an interrupted import after the last stored ``_id``
+    :return: the number of documents imported
+    """
+    fmt = FORMATS[format]
+    state = _read_state(path + ".import") if resume else None
+    n = 0
+    fp = open(path, "rb")
+    if state is not None:
+        fp.seek(state['offset'])
+        n = state['count']
+
+    def flush(batch):
+        # remove existing documents first so we can use a bulk insert
+        coll.collection.remove({'_id' : {'$in' : [d['_id'] for d in batch]}})
+        coll.collection.insert(batch)
+        _write_state(path + ".import", {'last_id' : batch[-1]['_id'],
+                                        'offset' : fp.tell(), 'count' : n})
+
+    try:
+        batch = []
+        for doc in fmt.read(fp):
+            if process:
+                doc = _process(coll, doc)
+            batch.append(doc)
+            n = n + 1
+            if len(batch) >= chunk_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        fp.close()
+    _clear_state(path + ".import")
+    coll.trigger(coll.event_name("update:after"), {'coll' : coll})
+    return n
+
+def run_parallel(func, items, jobs=4):
+    """call ``func(item)`` for all ``items`` in ``jobs`` threads.
+
+    :return: a tuple ``(results, errors)`` of dictionaries mapping the items
+        to the result or the exception raised
+    """
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+    results = {}
+    errors = {}
+
+    def work():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[item] = func(item)
+            except Exception, e:
+                errors[item] = e
+
+    threads = [threading.Thread(target=work) for i in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
@@ -5,11 +5,48 @@ import werkzeug.wsgi
 import os
 
 import setup
+from staticfiles import StaticFiles
+from conditional import compute_validators, is_not_modified, \
+                        set_validators, not_modified
 
 # for logging setup
 from starflyer.contrib import MongoHandler
 from logbook import NestedSetup, FileHandler
 
+class ConditionalHandler(Handler):
+    """a handler supporting conditional GET requests. Call 
+    ``check_modified()`` with the records the page depends on before
+    rendering anything and return the response it gives you if any::
+
+        def get(self):
+            stamps = self.settings.entries.stamps(sort_key="date", limit=10)
+            response = self.check_modified(stamps)
+            if response is not None:
+                return response
+            ...
+            return self.add_validators(response)
+
+    Using ``Collection.stamps()`` means only ``_id`` and ``_updated`` are 
+    retrieved for the check and no records need to be decoded.
+    """
+
+    validators = None
+
+    def check_modified(self, objs, extra=u""):
+        """compute the validators for ``objs`` (see ``compute_validators()``)
+        and return a ``304 Not Modified`` response if the client's copy is 
+        still valid or ``None`` if the page needs to be rendered"""
+        self.validators = compute_validators(objs, extra)
+        if is_not_modified(self.request, *self.validators):
+            return not_modified(*self.validators)
+        return None
+
+    def add_validators(self, response):
+        """add the validators computed in ``check_modified()`` to ``response``"""
+        if self.validators is not None:
+            set_validators(response, *self.validators)
+        return response
+
 class App(Application):
 
     def setup_handlers(self, map):
@@ -30,6 +67,9 @@ class App(Application):
 def app_factory(**local_conf):
     settings = setup.setup(**local_conf)
     app = App(settings)
+    if settings.static_manifest:
+        # serve the fingerprinted and precompressed files from build_assets
+        return StaticFiles(app, settings.static_build_path)
     app = werkzeug.wsgi.SharedDataMiddleware(app, {
         '/css': os.path.join(settings.static_file_path, 'css'),
         '/js': os.path.join(settings.static_file_path, 'js'),
@@ -0,0 +1,185 @@
+import datetime
+import optparse
+import os
+import sys
+import time
+
+from jinja2 import TemplateSyntaxError
+
+import setup
+from staticfiles import build_assets as build
+from quantumblog.db import get_collections, export_collection, \
+                           import_collection, run_parallel, FORMATS
+
+def _collections(settings):
+    """return the registered collections or exit if there are none"""
+    colls = get_collections(settings)
+    if not colls:
+        print "no collections registered, see quantumblog.setup.register_collections"
+        sys.exit(1)
+    return colls
+
+def ensure_indexes():
+    """create the indexes of all collections"""
+    parser = optparse.OptionParser(usage="%prog")
+    options, args = parser.parse_args()
+    settings = setup.setup()
+    for name, coll in _collections(settings).items():
+        coll.ensure_indexes()
+        print "%s: %s indexes" %(name, len(coll.indexes))
+    queue = getattr(settings.events, "queue", None)
+    if queue is not None:
+        queue.ensure_indexes()
+        print "event queue: 1 index"
+
+def archive():
+    """move records deleted a while ago to the archive collections"""
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-d", "--days", dest="days", type="int", default=30,
+        help="archive records deleted at least DAYS days ago [default: %default]")
+    options, args = parser.parse_args()
+    settings = setup.setup()
+    older_than = datetime.timedelta(days=options.days)
+    for name, coll in _collections(settings).items():
+        n = coll.archive_deleted(older_than)
+        print "%s: %s records archived" %(name, n)
+
+def compile_templates(env):
+    """load all templates of ``env`` so they end up in its bytecode cache.
+    
+    :return: a tuple ``(compiled, errors)`` with the list of compiled template
+        names and a dictionary mapping the names of failed ones to the error
+    """
+    compiled = []
+    errors = {}
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+            compiled.append(name)
+        except (TemplateSyntaxError, UnicodeError), e:
+            errors[name] = e
+    return compiled, errors
+
+def precompile():
+    """compile all templates into the bytecode cache, e.g. after a deploy"""
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-p", "--path", dest="path", default=None,
+        help="the bytecode cache directory [default: ~/.cache/quantumblog/templates]")
+    options, args = parser.parse_args()
+    settings = setup.setup(template_cache_path=options.path)
+    if settings.templates.bytecode_cache is None:
+        print "no bytecode cache available in %s" %settings.template_cache_path
+        sys.exit(1)
+    compiled, errors = compile_templates(settings.templates)
+    for name, e in errors.items():
+        print "%s: %s" %(name, e)
+    print "%s templates compiled, %s failed" %(len(compiled), len(errors))
+
+def build_assets():
+    """fingerprint and precompress the static files"""
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-k", "--keep-days", dest="keep_days", type="int", 
+        default=7, metavar="DAYS",
+        help="keep files of earlier builds for DAYS days [default: %default]")
+    options, args = parser.parse_args()
+    settings = setup.setup()
+    manifest = build(settings.static_file_path, settings.static_build_path,
+                     max_age = options.keep_days * 24 * 3600)
+    print "%s files written to %s" %(len(manifest), settings.static_build_path)
+
+def process_events():
+    """process the jobs of the durable event queue"""
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-i", "--interval", dest="interval", type="float", 
+        default=1.0, help="seconds to wait if the queue is empty [default: %default]")
+    options, args = parser.parse_args()
+    settings = setup.setup()
+    _collections(settings) # the listeners belong to the collections
+    events = settings.events
+    while True:
+        events.queue.requeue_stale()
+        if events.queue.process(events, settings) == 0:
+            time.sleep(options.interval)
+
+def _transfer_options(usage):
+    """return the option parser for ``export_data`` and ``import_data``"""
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option("-f", "--format", dest="format", default="jsonl",
+        choices=FORMATS.keys(), help="jsonl or bson [default: %default]")
+    parser.add_option("-p", "--process", dest="process", action="store_true",
+        help="pass the documents through the field pipelines of the records")
+    parser.add_option("-c", "--chunk-size", dest="chunk_size", type="int", 
+        default=1000, help="documents per chunk [default: %default]")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+        help="number of collections to process in parallel [default: %default]")
+    parser.add_option("-r", "--resume", dest="resume", action="store_true",
+        help="continue an interrupted run")
+    return parser
+
+def _transfer(func, directory, options, names, settings, **kw):
+    """run ``func`` for the named collections in parallel and report"""
+    colls = _collections(settings)
+    if not names:
+        names = sorted(colls.keys())
+    unknown = [n for n in names if not colls.has_key(n)]
+    if unknown:
+        print "unknown collections: %s" %", ".join(unknown)
+        sys.exit(1)
+
+    def run(name):
+        path = os.path.join(directory, name + FORMATS[options.format].suffix)
+        return func(colls[name], path, options.format, options.process,
+                    options.chunk_size, options.resume)
+
+    results, errors = run_parallel(run, names, options.jobs)
+    for name in names:
+        if results.has_key(name):
+            print "%s: %s documents" %(name, results[name])
+        else:
+            print "%s: FAILED: %s" %(name, errors[name])
+    if errors:
+        sys.exit(1)
+    return results
+
+def export_data():
+    """export collections to a directory"""
+    parser = _transfer_options("%prog [options] DIRECTORY [COLLECTION ...]")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("please give the directory to export to")
+    settings = setup.setup()
+    if not os.path.exists(args[0]):
+        os.makedirs(args[0])
+    _transfer(export_collection, args[0], options, args[1:], settings)
+
+def import_data():
+    """import collections from a directory created by ``export_data``.
+
+    The import bypasses ``put()``, so use ``--rebuild`` to bring the derived
+    data up to date: the denormalized fields of the imported collections
+    and of the collections copying values from them, the aggregates and
+    the search indexes. Cached fragments are invalidated in any case, but
+    only for the running web processes if they share a ``cache_backend``
+    with this script. Otherwise restart them."""
+    parser = _transfer_options("%prog [options] DIRECTORY [COLLECTION ...]")
+    parser.add_option("--rebuild", dest="rebuild", action="store_true",
+        help="refresh denormalized fields and rebuild aggregates and search "
+             "indexes after the import")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("please give the directory to import from")
+    settings = setup.setup()
+    results = _transfer(import_collection, args[0], options, args[1:], settings)
+    if options.rebuild:
+        colls = _collections(settings)
+        for name, coll in sorted(colls.items()):
+            sources = [d.source for d in coll.data_cls.denormalized.values()]
+            if coll.data_cls.denormalized and \
+                    (results.has_key(name) or set(sources) & set(results)):
+                n = coll.refresh_denormalized()
+                print "%s: %s denormalized records refreshed" %(name, n)
+        for name in results:
+            coll = colls[name]
+            coll.rebuild_aggregates()
+            if coll.data_cls.searchable:
+                coll.search_index.rebuild()
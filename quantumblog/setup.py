@@ -1,10 +1,69 @@
+import errno
+import os
 import pkg_resources
 import pymongo
 import starflyer
 
-from jinja2 import Environment, PackageLoader, PrefixLoader
+from jinja2 import Environment, PackageLoader, PrefixLoader, \
+                   FileSystemBytecodeCache
 from logbook import Logger
 
+from quantumblog.db import Events, DurableQueue, connect_listeners, \
+                           get_collections
+from quantumblog.cache import FragmentCache, FragmentCacheExtension
+from quantumblog.staticfiles import load_manifest, manifest_version, asset_url
+
+def bytecode_cache(settings):
+    """return the bytecode cache for the templates or ``None``. If the
+    directory can't be created we log a warning and work without one
+    instead of failing to start."""
+    if not settings.template_bytecode_cache:
+        return None
+    path = settings.template_cache_path
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST: # another worker might have created it
+            if settings.get("log", None) is not None:
+                settings.log.warn("template bytecode cache disabled, cannot "
+                                  "create %s: %s" %(path, e))
+            return None
+    return FileSystemBytecodeCache(path)
+
+def create_environment(settings):
+    """create the Jinja2 environment for the templates. If 
+    ``template_bytecode_cache`` is set compiled templates are stored in 
+    ``template_cache_path`` so workers don't need to compile them again
+    (see ``bytecode_cache()``)."""
+    bcc = bytecode_cache(settings)
+    env = Environment(loader=PrefixLoader({
+        "framework" : PackageLoader("starflyer","templates"),
+        "master" : PackageLoader("quantumblog","templates"),
+    }), extensions=[FragmentCacheExtension], bytecode_cache=bcc)
+    env.fragment_cache = settings.fragment_cache
+    env.globals['asset_url'] = asset_url(settings.get("static_manifest", {}))
+    return env
+
+def register_collections(settings):
+    """store the collections in ``settings``. All functions in the
+    ``collection_factories`` setting and all entry points of the
+    ``quantumblog_collections`` group are called with the settings and
+    add their ``Collection`` instances to them, e.g.::
+
+        def collections(settings):
+            settings.users = Users(settings.db.users, settings = settings)
+
+    Everything working on all collections (listeners, the fragment cache,
+    the maintenance scripts) only sees the collections registered here."""
+    factories = list(settings.collection_factories)
+    for ep in pkg_resources.iter_entry_points("quantumblog_collections"):
+        factories.append(ep.load())
+    for factory in factories:
+        factory(settings)
+    if not get_collections(settings):
+        settings.log.warn("no collections registered, listeners and the "
+                          "fragment cache are not connected")
+
 def setup(**kw):
     """initialize the setup"""
     settings = starflyer.AttributeMapper()
@@ -12,21 +71,58 @@ def setup(**kw):
     settings.dbname = "quantumblog"
     settings.log_name = "quantumblog"
     settings.static_file_path = pkg_resources.resource_filename(__name__, 'static')
+    # the output of the ``build_assets`` script, defaults to ``static_build``
+    # next to ``static_file_path``
+    settings.static_build_path = None
 
     # cookie related
     # TODO: add expiration dates, domains etc. maybe make it a dict?
     settings.cookie_secret = "cw98c79ew87we987cw9c8w79e87"
     settings.session_cookie_name = "s"
     settings.message_cookie_name = "m"
+
+    # fragment cache, pass a memcache client as ``cache_backend`` to share it
+    settings.cache_backend = None
+    settings.fragment_cache_size = 1000
+
+    # template bytecode cache, see ``create_environment()``. The path 
+    # defaults to ``quantumblog/templates`` in the cache directory of the
+    # user (``$XDG_CACHE_HOME`` or ``~/.cache``). Loading the cache means
+    # executing it, so it must not be writable by anybody else. Set it 
+    # explicitly if ``precompile`` runs as a different user than the workers.
+    settings.template_bytecode_cache = True
+    settings.template_cache_path = None
+
+    # functions adding the collections, see ``register_collections()``
+    settings.collection_factories = []
     settings.update(kw)
 
     settings.log = Logger(settings.log_name)
+    if settings.static_build_path is None:
+        settings.static_build_path = os.path.join(
+            os.path.dirname(settings.static_file_path), 'static_build')
+    if settings.template_cache_path is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME", None) or \
+                     os.path.join(os.path.expanduser("~"), ".cache")
+        settings.template_cache_path = os.path.join(cache_home, 
+                                                    'quantumblog', 'templates')
+    settings.static_manifest = load_manifest(settings.static_build_path)
+    if "events" not in settings:
+        settings.events = Events()
 
-    settings.templates = Environment(loader=PrefixLoader({
-        "framework" : PackageLoader("starflyer","templates"),
-        "master" : PackageLoader("quantumblog","templates"),
-    }))
+    settings.fragment_cache = FragmentCache(settings.cache_backend, 
+        settings.fragment_cache_size, 
+        version = manifest_version(settings.static_manifest))
+    settings.templates = create_environment(settings)
     db = settings.db = pymongo.Connection()[settings.dbname]
     settings.logdb = db.logging
+    if isinstance(settings.events, Events) and settings.events.queue is None:
+        settings.events.queue = DurableQueue(db.event_queue)
+
+    register_collections(settings)
+
+    # all collections are known now so they can listen to each other
+    connect_listeners(settings)
+    settings.fragment_cache.connect(settings)
     return settings
 
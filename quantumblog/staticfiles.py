@@ -0,0 +1,232 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from cStringIO import StringIO
+
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ['build_assets', 'load_manifest', 'manifest_version', 'asset_url',
+           'StaticFiles']
+
+MANIFEST = "manifest.json"
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.ico')
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=300"
+
+# the encodings we can serve in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+def _fingerprint(filename, data):
+    """return ``filename`` with a hash of ``data`` inserted before the suffix"""
+    base, ext = os.path.splitext(filename)
+    return "%s.%s%s" %(base, hashlib.md5(data).hexdigest()[:12], ext)
+
+def _gzip(data):
+    """return ``data`` gzipped with a fixed mtime so builds are reproducible"""
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+def _write(path, data):
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def _write_atomic(path, data):
+    """write ``data`` to a temporary file first and rename it to ``path`` so
+    readers never see a partially written file"""
+    _write(path + ".tmp", data)
+    os.rename(path + ".tmp", path)
+
+def build_assets(src, dest, dirs=('css', 'js', 'img'), 
+                 max_age=7*24*3600):
+    """copy the static files in the ``dirs`` of ``src`` to ``dest`` under
+    fingerprinted names. Compressible files get precompressed ``.gz`` (and
+    ``.br`` if the brotli module is installed) copies next to them. The
+    mapping from original to fingerprinted names is written to
+    ``manifest.json`` in ``dest``.
+
+    Files of earlier builds are kept for ``max_age`` seconds after they were
+    last part of a build, so pages rendered and cached before a deploy can
+    still load them.
+
+    :return: the manifest as a dictionary
+    """
+    manifest = {}
+    written = set()
+    for d in dirs:
+        for root, subdirs, files in os.walk(os.path.join(src, d)):
+            rel_root = os.path.relpath(root, src)
+            if not os.path.isdir(os.path.join(dest, rel_root)):
+                os.makedirs(os.path.join(dest, rel_root))
+            for filename in files:
+                f = open(os.path.join(root, filename), "rb")
+                try:
+                    data = f.read()
+                finally:
+                    f.close()
+                name = _fingerprint(filename, data)
+                target = os.path.join(dest, rel_root, name)
+                variants = [(target, data)]
+                if os.path.splitext(filename)[1].lower() in COMPRESSIBLE:
+                    compressed = _gzip(data)
+                    if len(compressed) < len(data):
+                        variants.append((target + ".gz", compressed))
+                    if brotli is not None:
+                        compressed = brotli.compress(data)
+                        if len(compressed) < len(data):
+                            variants.append((target + ".br", compressed))
+                for path, content in variants:
+                    if os.path.exists(path):
+                        os.utime(path, None) # it's still in use
+                    else:
+                        _write_atomic(path, content)
+                    written.add(path)
+                key = "/".join(rel_root.split(os.sep) + [filename])
+                manifest[key] = "/".join(rel_root.split(os.sep) + [name])
+    _write_atomic(os.path.join(dest, MANIFEST), json.dumps(manifest, indent=2))
+    _prune(dest, dirs, written, max_age)
+    return manifest
+
+def _prune(dest, dirs, keep, max_age):
+    """remove the files in ``dest`` not in ``keep`` which were not used by
+    a build for ``max_age`` seconds"""
+    limit = time.time() - max_age
+    for d in dirs:
+        for root, subdirs, files in os.walk(os.path.join(dest, d)):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if path not in keep and os.path.getmtime(path) < limit:
+                    os.remove(path)
+
+def manifest_version(manifest):
+    """return a short hash of ``manifest`` which changes with every build
+    changing a file, e.g. to be used in cache keys of rendered pages
+    containing asset URLs"""
+    data = json.dumps(manifest, sort_keys=True)
+    return hashlib.md5(data).hexdigest()[:12]
+
+def load_manifest(path):
+    """return the manifest in the build directory ``path`` or an empty
+    dictionary if there is none"""
+    filename = os.path.join(path, MANIFEST)
+    if not os.path.exists(filename):
+        return {}
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def asset_url(manifest):
+    """return a function to be used in templates which returns the URL of a
+    static file like ``asset_url('css/screen.css')``, using the fingerprinted
+    name if it's in the manifest"""
+    def url_for(path):
+        path = path.lstrip("/")
+        return "/" + manifest.get(path, path)
+    return url_for
+
+class StaticFiles(object):
+    """a WSGI middleware serving the files built by ``build_assets()``.
+
+    All files are scanned once on startup so no filesystem calls besides
+    opening the file are needed per request. If the client accepts it a
+    precompressed variant is served. Fingerprinted files, including the
+    ones of earlier builds still in the directory, are served with far
+    future cache headers as their URL changes with their contents. Requests
+    for the original names in the manifest are served as well but need to
+    be revalidated after a while.
+    """
+
+    def __init__(self, app, path, prefixes=('css', 'js', 'img')):
+        """initialize the middleware
+
+        :param app: the WSGI application to pass all other requests to
+        :param path: the build directory
+        :param prefixes: the top level directories to serve
+        """
+        self.app = app
+        self.files = {}
+        suffixes = tuple([suffix for encoding, suffix in ENCODINGS])
+        for prefix in prefixes:
+            for root, subdirs, files in os.walk(os.path.join(path, prefix)):
+                for filename in files:
+                    if filename.endswith(".tmp") or [s for s in suffixes
+                            if filename.endswith(s) and filename[:-len(s)] in files]:
+                        continue # variants are picked up by _scan()
+                    rel = os.path.relpath(os.path.join(root, filename), path)
+                    url = "/" + "/".join(rel.split(os.sep))
+                    info = self._scan(os.path.join(root, filename))
+                    self.files[url] = dict(info, cache_control=IMMUTABLE)
+        for original, name in load_manifest(path).items():
+            info = self.files.get("/" + name, None)
+            if info is not None:
+                self.files["/" + original] = dict(info, cache_control=REVALIDATE)
+
+    def _scan(self, filename):
+        """return the information needed to serve ``filename``"""
+        content_type = mimetypes.guess_type(filename)[0] or \
+                       "application/octet-stream"
+        variants = {None : (filename, os.path.getsize(filename))}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(filename + suffix):
+                variants[encoding] = (filename + suffix,
+                                      os.path.getsize(filename + suffix))
+        f = open(filename, "rb")
+        try:
+            etag = hashlib.md5(f.read()).hexdigest()[:12]
+        finally:
+            f.close()
+        return {
+            'content_type' : content_type,
+            'variants' : variants,
+            'etag' : etag,
+        }
+
+    def _choose(self, info, environ):
+        """return the encoding to use for the request"""
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        for encoding, suffix in ENCODINGS:
+            if info['variants'].has_key(encoding) and accepted[encoding] > 0:
+                return encoding
+        return None
+
+    def __call__(self, environ, start_response):
+        info = self.files.get(environ.get("PATH_INFO", ""), None)
+        if info is None or environ['REQUEST_METHOD'] not in ("GET", "HEAD"):
+            return self.app(environ, start_response)
+
+        encoding = self._choose(info, environ)
+        etag = info['etag'] + ("-" + encoding if encoding else "")
+        headers = [
+            ('Content-Type', info['content_type']),
+            ('Cache-Control', info['cache_control']),
+            ('ETag', quote_etag(etag)),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if parse_etags(environ.get("HTTP_IF_NONE_MATCH", None)).contains(etag):
+            start_response("304 Not Modified", headers)
+            return []
+
+        filename, size = info['variants'][encoding]
+        headers.append(('Content-Length', str(size)))
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        start_response("200 OK", headers)
+        if environ['REQUEST_METHOD'] == "HEAD":
+            return []
+        return wrap_file(environ, open(filename, "rb"))
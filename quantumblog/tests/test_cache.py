@@ -0,0 +1,130 @@
+import datetime
+
+import starflyer
+
+from quantumblog.cache import LRUCache, FragmentCache, record_stamps
+from quantumblog.db import Record, Collection, Field, Denormalized, Events
+from quantumblog.db.tests.memorydb import MemoryDatabase
+
+class Backend(object):
+    """the parts of a memcache client the fragment cache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, None)
+
+    def set(self, key, value, timeout=0):
+        self.data[key] = value
+
+    def add(self, key, value, timeout=0):
+        if self.data.has_key(key):
+            return False
+        self.data[key] = value
+        return True
+
+    def incr(self, key):
+        if not self.data.has_key(key):
+            return None
+        self.data[key] = self.data[key] + 1
+        return self.data[key]
+
+class User(Record):
+    fields = {
+        'username' : Field(),
+    }
+
+class Entry(Record):
+    fields = {
+        'user_id' : Field(),
+    }
+    denormalized = {
+        'author_name' : Denormalized('users', 'user_id', 'username'),
+    }
+
+class Users(Collection):
+    data_cls = User
+
+class Entries(Collection):
+    data_cls = Entry
+
+def test_lru():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1 # now b is the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    cache.set("a", 4)
+    assert cache.get("a") == 4
+    cache.delete("a")
+    cache.delete("x")
+    assert cache.get("a", "default") == "default"
+    assert cache.data.keys() == ["c"]
+
+def test_record_stamps():
+    now = datetime.datetime.now()
+    entry = {'_id' : 1, '_updated' : now}
+    view = {'entry' : entry, 'user' : {'_id' : 2}}
+    assert record_stamps(entry) == [(1, now)]
+    assert sorted(record_stamps([view, (entry,)])) == \
+        [(1, now), (1, now), (2, None)]
+    assert record_stamps(u"foo") == []
+
+def test_key():
+    cache = FragmentCache()
+    coll = Users(MemoryDatabase().users)
+    entry = {'_id' : 1, '_updated' : datetime.datetime.now()}
+    key = cache.key("teaser", [entry])
+    assert key == cache.key("teaser", [entry])
+    assert key != cache.key("other", [entry])
+    assert key != FragmentCache(version="abc").key("teaser", [entry])
+    entry['_updated'] = entry['_updated'] + datetime.timedelta(seconds=1)
+    assert key != cache.key("teaser", [entry])
+
+    key = cache.key("list", [coll])
+    assert key == cache.key("list", [coll])
+    cache.invalidate("users")
+    assert key != cache.key("list", [coll])
+
+def test_backend_generations():
+    backend = Backend()
+    cache = FragmentCache(backend)
+    other = FragmentCache(backend)
+    assert cache.generation("users") == 0
+    cache.invalidate("users")
+    other.invalidate("users")
+    assert cache.generation("users") == other.generation("users") == 2
+
+def make_connected():
+    """return settings with a user, an entry of it and a connected cache"""
+    db = MemoryDatabase()
+    settings = starflyer.AttributeMapper()
+    settings.events = Events()
+    settings.users = Users(db.users, settings = settings)
+    settings.entries = Entries(db.entries, settings = settings)
+    settings.entries.setup_listeners()
+    cache = FragmentCache()
+    user = settings.users.put(User({'username' : u"alice"}))
+    settings.entries.put(Entry({'user_id' : user['_id']}))
+    cache.connect(settings)
+    return settings, cache, user
+
+def test_bulk_updates_invalidate():
+    settings, cache, user = make_connected()
+
+    gen = cache.generation("entries")
+    user['username'] = u"bob"
+    settings.users.put(user) # updates the entries without put()
+    assert cache.generation("entries") > gen
+
+def test_unrelated_updates_keep_generation():
+    settings, cache, user = make_connected()
+
+    gen = cache.generation("entries")
+    settings.users.put(User({'username' : u"bob"})) # has no entries
+    settings.users.put(user) # unchanged
+    assert cache.generation("entries") == gen
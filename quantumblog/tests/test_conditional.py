@@ -0,0 +1,58 @@
+import datetime
+
+from werkzeug import Request
+from werkzeug.http import http_date
+from werkzeug.test import create_environ
+
+from quantumblog.conditional import compute_validators, is_not_modified, \
+                                    to_utc
+
+def make_request(**headers):
+    headers = [(k.replace("_", "-"), v) for k, v in headers.items()]
+    return Request(create_environ(headers = headers))
+
+def make_entries():
+    now = datetime.datetime(2010, 5, 1, 12, 0, 0)
+    return [{'_id' : i, '_updated' : now - datetime.timedelta(hours=i)}
+            for i in range(3)]
+
+def test_etag():
+    entries = make_entries()
+    etag, last_modified = compute_validators(entries)
+    assert etag == compute_validators(make_entries())[0]
+    assert etag != compute_validators(entries[:2])[0] # membership changed
+    assert etag != compute_validators(entries, u"user1")[0]
+    entries[2]['_updated'] = datetime.datetime.now()
+    assert etag != compute_validators(entries)[0]
+
+def test_last_modified():
+    entries = make_entries()
+    assert compute_validators(entries[0])[1] == to_utc(entries[0]['_updated'])
+    # lists and pages depending on extra data only get an ETag
+    assert compute_validators(entries)[1] is None
+    assert compute_validators(entries[0], u"user1")[1] is None
+    assert compute_validators({'_id' : 1})[1] is None
+
+def test_if_none_match():
+    etag, last_modified = compute_validators(make_entries()[0])
+    assert is_not_modified(make_request(If_None_Match = '"%s"' %etag), etag)
+    assert not is_not_modified(make_request(If_None_Match = '"foo"'), etag)
+    assert not is_not_modified(make_request(), etag, last_modified)
+
+    # If-None-Match takes precedence
+    request = make_request(If_None_Match = '"foo"', 
+                           If_Modified_Since = http_date(last_modified))
+    assert not is_not_modified(request, etag, last_modified)
+
+def test_if_modified_since():
+    etag, last_modified = compute_validators(make_entries()[0])
+    request = make_request(If_Modified_Since = http_date(last_modified))
+    assert is_not_modified(request, etag, last_modified)
+    older = last_modified - datetime.timedelta(seconds=1)
+    request = make_request(If_Modified_Since = http_date(older))
+    assert not is_not_modified(request, etag, last_modified)
+
+def test_if_modified_since_for_lists():
+    etag, last_modified = compute_validators(make_entries())
+    request = make_request(If_Modified_Since = http_date(datetime.datetime.now()))
+    assert not is_not_modified(request, etag, last_modified)
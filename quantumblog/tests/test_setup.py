@@ -0,0 +1,37 @@
+import os
+
+import starflyer
+
+from quantumblog.setup import bytecode_cache
+
+class Log(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+def make_settings(path):
+    settings = starflyer.AttributeMapper()
+    settings.template_bytecode_cache = True
+    settings.template_cache_path = path
+    settings.log = Log()
+    return settings
+
+def test_bytecode_cache(tmpdir):
+    path = str(tmpdir.join("cache", "templates"))
+    assert bytecode_cache(make_settings(path)) is not None
+    assert os.path.isdir(path)
+    # a second worker finds it existing
+    assert bytecode_cache(make_settings(path)) is not None
+
+def test_bytecode_cache_unavailable(tmpdir):
+    tmpdir.join("file").write("")
+    settings = make_settings(str(tmpdir.join("file", "templates")))
+    assert bytecode_cache(settings) is None
+    assert len(settings.log.warnings) == 1
+
+def test_bytecode_cache_disabled(tmpdir):
+    settings = make_settings(str(tmpdir.join("templates")))
+    settings.template_bytecode_cache = False
+    assert bytecode_cache(settings) is None
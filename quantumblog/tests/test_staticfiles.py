@@ -0,0 +1,106 @@
+import os
+
+from werkzeug import Response
+from werkzeug.test import Client
+
+from quantumblog.staticfiles import build_assets, load_manifest, \
+                                    manifest_version, StaticFiles
+
+CSS = "body { color: red; }\n" * 50
+
+def not_found(environ, start_response):
+    start_response("404 Not Found", [('Content-Type', 'text/plain')])
+    return ["not found"]
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, "wb")
+    f.write(data)
+    f.close()
+
+def make_build(tmpdir):
+    src = str(tmpdir.join("static"))
+    dest = str(tmpdir.join("static_build"))
+    write(os.path.join(src, "css", "screen.css"), CSS)
+    write(os.path.join(src, "img", "logo"), "no extension")
+    manifest = build_assets(src, dest)
+    return src, dest, manifest
+
+def make_client(dest):
+    return Client(StaticFiles(not_found, dest), Response)
+
+def test_build(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    assert load_manifest(dest) == manifest
+    name = manifest['css/screen.css']
+    assert name.startswith("css/screen.") and name.endswith(".css")
+    assert os.path.exists(os.path.join(dest, name + ".gz"))
+    assert not os.path.exists(os.path.join(dest, "manifest.json.tmp"))
+
+def test_keep_old_files(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    old = os.path.join(dest, manifest['css/screen.css'])
+    write(os.path.join(src, "css", "screen.css"), CSS + "p { margin: 0; }\n")
+    new = build_assets(src, dest)
+    assert new['css/screen.css'] != manifest['css/screen.css']
+    assert manifest_version(new) != manifest_version(manifest)
+    assert os.path.exists(old)
+
+    # and they are still served
+    response = make_client(dest).get("/" + manifest['css/screen.css'])
+    assert response.status_code == 200
+
+    # until they are too old
+    os.utime(old, (0, 0))
+    build_assets(src, dest)
+    assert not os.path.exists(old)
+    assert os.path.exists(os.path.join(dest, new['css/screen.css']))
+
+def test_encoding(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    client = make_client(dest)
+    url = "/" + manifest['css/screen.css']
+    response = client.get(url, headers=[('Accept-Encoding', 'gzip, deflate')])
+    assert response.headers['Content-Encoding'] == "gzip"
+    assert response.headers['Vary'] == "Accept-Encoding"
+    assert len(response.data) < len(CSS)
+
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == CSS
+    response = client.get(url, headers=[('Accept-Encoding', 'gzip;q=0')])
+    assert response.data == CSS
+
+def test_cache_headers(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    client = make_client(dest)
+    response = client.get("/" + manifest['css/screen.css'])
+    assert "immutable" in response.headers['Cache-Control']
+    assert response.headers['Content-Type'].startswith("text/css")
+    response = client.get("/css/screen.css")
+    assert response.headers['Cache-Control'] == "public, max-age=300"
+    assert response.data == CSS
+    assert client.get("/css/other.css").status_code == 404
+
+def test_not_modified(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    client = make_client(dest)
+    url = "/" + manifest['css/screen.css']
+    etag = client.get(url).headers['ETag']
+    response = client.get(url, headers=[('If-None-Match', etag)])
+    assert response.status_code == 304
+    assert response.data == ""
+
+    # the compressed variant has its own ETag
+    response = client.get(url, headers=[('If-None-Match', etag),
+                                        ('Accept-Encoding', 'gzip')])
+    assert response.status_code == 200
+
+def test_etag_without_extension(tmpdir):
+    src, dest, manifest = make_build(tmpdir)
+    client = make_client(dest)
+    logo = client.get("/" + manifest['img/logo'])
+    css = client.get("/" + manifest['css/screen.css'])
+    assert logo.data == "no extension"
+    assert logo.headers['ETag'] not in (css.headers['ETag'], '"logo"')
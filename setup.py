@@ -24,6 +24,13 @@ setup(name='quantumblog',
       entry_points="""
         [console_scripts]
         run = starflyer.scripts:run
+        ensure_indexes = quantumblog.scripts:ensure_indexes
+        archive = quantumblog.scripts:archive
+        precompile = quantumblog.scripts:precompile
+        build_assets = quantumblog.scripts:build_assets
+        process_events = quantumblog.scripts:process_events
+        export_data = quantumblog.scripts:export_data
+        import_data = quantumblog.scripts:import_data
         [starflyer_app_factory]
         default = quantumblog.main:app_factory
         [starflyer_setup]